@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from feed_index import feed_entity
+from gallery_cache import create_gallery_cache
+
+# Azure Tables accepts at most 100 operations and 4 MB per transaction, all in one partition
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+# Headroom for the multipart framing around each entity in the batch request
+BATCH_OVERHEAD_BYTES = 64 * 1024
+
+
+def group_by_partition(entities):
+    """
+    Groups entities by PartitionKey, keeping input order. A later entity with the same RowKey
+    replaces an earlier one, since a transaction may not touch a row twice.
+
+    Returns:
+        OrderedDict: PartitionKey -> list of entities.
+    """
+    partitions = OrderedDict()
+    for entity in entities:
+        partitions.setdefault(entity['PartitionKey'], OrderedDict())[entity['RowKey']] = entity
+    return OrderedDict((partition_key, list(rows.values())) for partition_key, rows in partitions.items())
+
+
+def make_batches(entities, max_operations=MAX_BATCH_OPERATIONS, max_bytes=MAX_BATCH_BYTES - BATCH_OVERHEAD_BYTES):
+    """
+    Splits one partition's entities into transactions under both service limits. The split only
+    depends on the entities, so the same input always gives the same batches to resume from.
+    """
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for entity in entities:
+        entity_bytes = len(json.dumps(entity, default=str))
+        if batch and (len(batch) >= max_operations or batch_bytes + entity_bytes > max_bytes):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(entity)
+        batch_bytes += entity_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Checkpoint:
+    """
+    Number of batches committed per partition, and the RowKey that ended the last one, saved to
+    a JSON file after every batch so an interrupted ingest can pick up where it stopped. Batches
+    are upserts, so one that committed just before a crash, without being recorded, is safely
+    written again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._done = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self._done = json.load(checkpoint_file)
+
+    def completed(self, partition_key):
+        """
+        Returns:
+            tuple: Batches done and the last RowKey committed, or (0, None).
+        """
+        with self._lock:
+            done = self._done.get(partition_key)
+        if done is None:
+            return 0, None
+        return done['batches'], done['last_row_key']
+
+    def record(self, partition_key, batches_done, last_row_key):
+        with self._lock:
+            self._done[partition_key] = {'batches': batches_done, 'last_row_key': last_row_key}
+            if self.path:
+                # Write then rename, so a crash mid-write never leaves a truncated checkpoint
+                temp_path = f"{self.path}.tmp"
+                with open(temp_path, 'w') as checkpoint_file:
+                    json.dump(self._done, checkpoint_file)
+                os.replace(temp_path, self.path)
+
+
+def ingest_partition(table_client, partition_key, entities, checkpoint):
+    """
+    Writes one partition's entities as upsert transactions, skipping batches the checkpoint
+    already has.
+
+    Returns:
+        tuple: Entities written and entities skipped.
+
+    Raises:
+        ValueError: If the checkpoint was recorded for different input, since skipping by batch
+            index would then leave rows unwritten.
+    """
+    written = 0
+    skipped = 0
+    batches = make_batches(entities)
+    done, last_row_key = checkpoint.completed(partition_key)
+    if done and (done > len(batches) or batches[done - 1][-1]['RowKey'] != last_row_key):
+        raise ValueError(f"Checkpoint does not match the input for partition {partition_key}; remove it to start over")
+    for index, batch in enumerate(batches):
+        if index < done:
+            skipped += len(batch)
+            continue
+        table_client.submit_transaction([('upsert', entity) for entity in batch])
+        checkpoint.record(partition_key, index + 1, batch[-1]['RowKey'])
+        written += len(batch)
+    return written, skipped
+
+
+def bulk_ingest(table_client, entities, checkpoint=None, max_workers=8):
+    """
+    Upserts entities in 100-operation transactions, grouped by PartitionKey, with up to
+    max_workers partitions written in parallel. Batches within a partition run in order.
+
+    Args:
+        table_client (TableClient): The table to write to.
+        entities (iterable): Dicts with PartitionKey and RowKey.
+        checkpoint (Checkpoint): Progress to resume from and record to; in memory if omitted.
+        max_workers (int): How many partitions are written at once.
+
+    Returns:
+        dict: 'written' and 'skipped' entity counts, and 'failed', PartitionKey -> error, for
+            partitions that stopped part way; re-running with the same checkpoint retries them.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    partitions = group_by_partition(entities)
+    result = {'written': 0, 'skipped': 0, 'failed': {}}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            partition_key: executor.submit(ingest_partition, table_client, partition_key, partition_entities, checkpoint)
+            for partition_key, partition_entities in partitions.items()
+        }
+        for partition_key, future in futures.items():
+            try:
+                written, skipped = future.result()
+            except Exception as e:
+                result['failed'][partition_key] = str(e)
+                continue
+            result['written'] += written
+            result['skipped'] += skipped
+    return result
+
+
+def read_entities(path):
+    # One JSON entity per line
+    with open(path) as entities_file:
+        for line in entities_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk upsert image entities from a JSON lines file.")
+    parser.add_argument("entities", help="File with one image entity per line, as create_table_entry writes them")
+    parser.add_argument("--checkpoint", help="JSON file to record progress in and resume from")
+    parser.add_argument("--workers", type=int, default=8, help="Partitions written in parallel")
+    parser.add_argument("--feed", action="store_true", help="Also write each image's feed row")
+    args = parser.parse_args()
+
+    # Built here rather than imported from server, which starts its process pools on import
+    from azure.data.tables import TableServiceClient
+    from dotenv import load_dotenv
+    load_dotenv()
+    account_key = os.environ.get("BLOB_ACCOUNT_KEY")
+    connection_string = f"DefaultEndpointsProtocol=https;AccountName=worlddexstorage2;AccountKey={account_key};EndpointSuffix=core.windows.net"
+    table_service_client = TableServiceClient.from_connection_string(connection_string)
+    table_client = table_service_client.get_table_client(table_name="dextablestorage")
+    feed_table_client = table_service_client.get_table_client(table_name="dexfeed")
+    entities = list(read_entities(args.entities))
+    checkpoint = Checkpoint(args.checkpoint)
+    results = {"images": bulk_ingest(table_client, entities, checkpoint, args.workers)}
+    # Image partitions are users, so drop any gallery cached while their rows were changing,
+    # including partitions that failed part way. Only a shared cache can be reached from here
+    gallery_cache_url = os.environ.get("GALLERY_CACHE_URL")
+    if gallery_cache_url:
+        gallery_cache = create_gallery_cache(gallery_cache_url)
+        for user_id in {entity['PartitionKey'] for entity in entities}:
+            gallery_cache.invalidate(user_id)
+    else:
+        print("GALLERY_CACHE_URL is not set: running servers keep cached galleries until GALLERY_CACHE_TTL_SECONDS passes")
+    if args.feed:
+        # Feed rows share one partition, so they go in sequential batches; a separate
+        # checkpoint file keeps their progress apart from the image partitions
+        feed_checkpoint = Checkpoint(f"{args.checkpoint}.feed" if args.checkpoint else None)
+        feed_rows = [feed_entity(entity) for entity in entities if entity.get('DateAdded')]
+        results["feed"] = bulk_ingest(feed_table_client, feed_rows, feed_checkpoint, args.workers)
+
+    for name, result in results.items():
+        print(f"{name}: {result['written']} written, {result['skipped']} already done, {len(result['failed'])} partitions failed")
+        for partition_key, error in result['failed'].items():
+            print(f"  {partition_key}: {error}")
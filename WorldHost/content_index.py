@@ -0,0 +1,89 @@
+import hashlib
+import json
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _keys(digest, suffix=''):
+    # The first two hex digits spread rows over 256 partitions
+    return digest[:2], digest + suffix
+
+
+def nft_suffix(eth_address):
+    # NFT uploads are encrypted to the owner's key, so they are only reusable per address
+    return '_nft_' + eth_address.lower()
+
+
+def lookup_blob(table_client, digest):
+    """
+    Returns the stored copy of an upload with this hash, or None if it has not been stored.
+
+    Returns:
+        dict: 'url', 'content_type', 'extension' and 'thumbnails' (size -> URL).
+    """
+    partition_key, row_key = _keys(digest)
+    try:
+        entity = table_client.get_entity(partition_key=partition_key, row_key=row_key)
+    except ResourceNotFoundError:
+        return None
+    return {
+        'url': entity['BlobURL'],
+        'content_type': entity['ContentType'],
+        'extension': entity['Extension'],
+        'thumbnails': json.loads(entity.get('ThumbnailURLs') or '{}')
+    }
+
+
+def record_blob(table_client, digest, url, content_type, extension, thumbnails=None):
+    """
+    Indexes a newly stored blob under the hash of the upload it was made from. If another
+    request indexed the same hash first, its entry is kept.
+    """
+    partition_key, row_key = _keys(digest)
+    try:
+        table_client.create_entity({
+            'PartitionKey': partition_key,
+            'RowKey': row_key,
+            'BlobURL': url,
+            'ContentType': content_type,
+            'Extension': extension,
+            'ThumbnailURLs': json.dumps(thumbnails or {})
+        })
+    except ResourceExistsError:
+        pass
+
+
+def lookup_nft(table_client, digest, eth_address):
+    """
+    Returns the (metadata_cid, metadata_url, mint_job_id) already recorded for this image and
+    owner, or None. mint_job_id is None until a mint has been queued for it.
+    """
+    partition_key, row_key = _keys(digest, nft_suffix(eth_address))
+    try:
+        entity = table_client.get_entity(partition_key=partition_key, row_key=row_key)
+    except ResourceNotFoundError:
+        return None
+    return entity['MetadataCid'], entity['MetadataURL'], entity.get('MintJobId')
+
+
+def record_nft(table_client, digest, eth_address, metadata_cid, metadata_url):
+    partition_key, row_key = _keys(digest, nft_suffix(eth_address))
+    table_client.upsert_entity({
+        'PartitionKey': partition_key,
+        'RowKey': row_key,
+        'MetadataCid': metadata_cid,
+        'MetadataURL': metadata_url
+    })
+
+
+def record_nft_mint(table_client, digest, eth_address, mint_job_id):
+    partition_key, row_key = _keys(digest, nft_suffix(eth_address))
+    table_client.update_entity({
+        'PartitionKey': partition_key,
+        'RowKey': row_key,
+        'MintJobId': mint_job_id
+    }, mode=UpdateMode.MERGE)
@@ -0,0 +1,108 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# scrypt cost parameters for new hashes; stored alongside each hash so they can be raised later
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def hash_password(password):
+    """
+    Hashes a password with scrypt.
+
+    Returns:
+        str: 'scrypt$n$r$p$salt$hash', with salt and hash base64url encoded.
+    """
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password, stored_hash):
+    """
+    Checks a password against a stored hash, accepting the legacy unsalted SHA-256 hex digests.
+
+    Returns:
+        tuple: Whether the password matches, and whether the stored hash should be replaced
+            with a fresh hash_password() result.
+    """
+    if stored_hash.startswith('scrypt$'):
+        _, n, r, p, salt, expected = stored_hash.split('$')
+        digest = hashlib.scrypt(password.encode(), salt=_b64decode(salt), n=int(n), r=int(r), p=int(p))
+        matches = hmac.compare_digest(digest, _b64decode(expected))
+        outdated = (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return matches, matches and outdated
+
+    legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+    matches = hmac.compare_digest(legacy_hash, stored_hash)
+    return matches, matches
+
+
+class CredentialService:
+    """
+    Runs the KDF in a process pool so logins and registrations don't tie up the event loop.
+    """
+
+    def __init__(self, max_workers=2):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    async def hash(self, password):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, hash_password, password)
+
+    async def verify(self, password, stored_hash):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, verify_password, password, stored_hash)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def issue_session_token(secret, claims, ttl):
+    """
+    Issues a signed, self-contained session token carrying claims.
+
+    Args:
+        secret (bytes): HMAC key shared by every worker.
+        claims (dict): JSON-serializable claims; 'sub' should be the username.
+        ttl (int): Lifetime in seconds.
+
+    Returns:
+        str: The token, as 'payload.signature'.
+    """
+    payload = _b64encode(json.dumps(dict(claims, exp=int(time.time()) + ttl)).encode())
+    signature = _b64encode(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+    return f"{payload}.{signature}"
+
+
+def verify_session_token(secret, token):
+    """
+    Returns the claims of a token issued with secret, or None if it is malformed, forged or expired.
+    """
+    try:
+        payload, signature = token.split('.')
+        expected = _b64encode(hmac.new(secret, payload.encode(), hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, expected):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except Exception:
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims
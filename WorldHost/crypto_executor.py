@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MeteredExecutor(ThreadPoolExecutor):
+    """
+    Thread pool for CPU-bound crypto (public key recovery, encryption, transaction signing) that
+    keeps counts of queued and running tasks and how long tasks waited for a thread.
+
+    The libraries doing the work (coincurve, cryptography, eth-account) are C-backed and release
+    the GIL, so threads keep it off the event loop without pickling keys and transactions across
+    a process boundary.
+    """
+
+    def __init__(self, max_workers=4, thread_name_prefix='crypto'):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_workers = max_workers
+        self._metrics_lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted_at = time.monotonic()
+        with self._metrics_lock:
+            self._queued += 1
+
+        def run():
+            wait = time.monotonic() - submitted_at
+            with self._metrics_lock:
+                self._queued -= 1
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                with self._metrics_lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._failed += failed
+
+        return super().submit(run)
+
+    def stats(self):
+        with self._metrics_lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(1000 * self._total_wait / self._completed, 3) if self._completed else 0.0,
+                "max_wait_ms": round(1000 * self._max_wait, 3)
+            }
@@ -4,12 +4,26 @@ from web3.middleware import geth_poa_middleware
 import os
 from dotenv import load_dotenv
 import json
+import asyncio
+from contextlib import asynccontextmanager
+from azure.data.tables import TableServiceClient
+from mint_worker import MintQueue, MintWorker, job_status
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app):
+    # Same flag and leader lease as server.py, which shares this queue and wallet
+    mint_task = None
+    if os.environ.get("MINT_WORKER_ENABLED", "true").lower() in ["true", "1", "yes"]:
+        mint_task = asyncio.create_task(mint_worker.run())
+    yield
+    if mint_task is not None:
+        mint_task.cancel()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Ethereum node connection
 WEB3_PROVIDER_URI = os.getenv("WEB3_PROVIDER")
@@ -31,37 +45,31 @@ contract = web3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
 WALLET_PRIVATE_KEY = os.getenv("WALLET_PRIVATE_KEY")
 WALLET_ADDRESS = os.getenv("WALLET_ADDRESS")
 
+# Mint jobs share the same table as the main server's queue
+account_name = "worlddexstorage2"
+account_key = os.environ.get("BLOB_ACCOUNT_KEY")
+connection_string = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
+table_service_client = TableServiceClient.from_connection_string(connection_string)
+mint_queue = MintQueue(table_service_client.create_table_if_not_exists(table_name="mintjobs"))
+mint_worker = MintWorker(mint_queue, web3, contract, WALLET_ADDRESS, WALLET_PRIVATE_KEY, chain_id=11155111)
+
 @app.post("/mint-nft/")
 async def mint_nft(cid: str, user_address: str):
-    # Ensure Ethereum address is valid
+    # Ensure Ethereum address is valid; the mint's ABI encoder only takes the checksummed form
     if not web3.is_address(user_address):
         raise HTTPException(status_code=400, detail="Invalid Ethereum address")
-
-    # Token URI (IPFS URL)
-    token_uri = f"ipfs://{cid}"
-
-    # Create a transaction
-    nonce = web3.eth.get_transaction_count(WALLET_ADDRESS)
-    # Prepare the transaction
-    txn = contract.functions.mintNFT(user_address, token_uri).build_transaction({
-        'from': WALLET_ADDRESS,  # The address the transaction is sent from
-        'chainId': 11155111,  # Replace with the correct chain ID
-        'gas': 2000000,
-        'gasPrice': web3.to_wei('50', 'gwei'),
-        'nonce': nonce,
-    })
-
-
-    # Sign the transaction
-    signed_txn = web3.eth.account.sign_transaction(txn, private_key=WALLET_PRIVATE_KEY)
-
-    # Send the transaction
-    txn_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
-
-    # Wait for transaction receipt (optional)
-    receipt = web3.eth.wait_for_transaction_receipt(txn_hash)
-
-    return {"transaction_hash": receipt.transactionHash.hex(), "status": "NFT Minted"}
+    user_address = web3.to_checksum_address(user_address)
+
+    # The worker sends the transaction and records its receipt; poll /mintStatus for the result
+    job_id = await asyncio.to_thread(mint_queue.enqueue, cid, user_address)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/mintStatus")
+async def mint_status(job_id: str):
+    job = await asyncio.to_thread(mint_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Mint job not found")
+    return job_status(job)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,49 @@
+import hashlib
+from azure.core.exceptions import ResourceExistsError
+
+# Email -> username rows live in the users table under this partition
+EMAIL_INDEX_PARTITION = "__email_index"
+
+
+def email_index_row_key(email):
+    """
+    Builds the RowKey for an email. Addresses are compared case-insensitively and hashed,
+    since they may contain characters that are not allowed in a RowKey.
+    """
+    return hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()
+
+
+def email_index_entity(email, username):
+    return {
+        'PartitionKey': EMAIL_INDEX_PARTITION,
+        'RowKey': email_index_row_key(email),
+        'Email': email,
+        'Username': username
+    }
+
+
+def backfill(users_table_client):
+    """
+    Writes index rows for users registered before the index existed. Safe to re-run.
+
+    Returns:
+        list: Emails shared by more than one existing user, which could not all be indexed.
+    """
+    duplicates = []
+    for entity in users_table_client.query_entities("RowKey eq 'userinfo'", select=['PartitionKey', 'Email']):
+        email = entity.get('Email')
+        if not email:
+            continue
+        try:
+            users_table_client.create_entity(email_index_entity(email, entity['PartitionKey']))
+        except ResourceExistsError:
+            existing = users_table_client.get_entity(EMAIL_INDEX_PARTITION, email_index_row_key(email))
+            if existing['Username'] != entity['PartitionKey']:
+                duplicates.append(email)
+    return duplicates
+
+
+if __name__ == "__main__":
+    from server import users_table_client
+    for email in backfill(users_table_client):
+        print(f"Email used by more than one account: {email}")
@@ -0,0 +1,77 @@
+import datetime
+
+# Every feed row lives in one partition so a page is a single ordered range scan
+FEED_PARTITION = "feed"
+# Milliseconds, comfortably past any timestamp we will ever write
+MAX_TIMESTAMP_MS = 10 ** 13
+
+# Image entity fields copied onto the feed row so a page needs no second lookup
+FEED_FIELDS = [
+    'LocationTaken', 'UserAddress', 'Details', 'Probability', 'ImageBlobURL',
+    'CroppedImageBlobURL', 'IPFSCid', 'ImageClassification', 'DateAdded', 'ThumbnailURLs'
+]
+
+
+def feed_row_key(date_added, image_id):
+    """
+    Builds a RowKey that sorts newest first.
+
+    Args:
+        date_added (str): ISO-8601 timestamp of the upload.
+        image_id (str): The image identifier, used to keep keys unique.
+
+    Returns:
+        str: The inverted-timestamp RowKey.
+    """
+    timestamp_ms = int(datetime.datetime.fromisoformat(date_added).timestamp() * 1000)
+    return f"{MAX_TIMESTAMP_MS - timestamp_ms:013d}_{image_id}"
+
+
+def feed_entity(image_entity):
+    """
+    Builds the feed index row for an image entity from dextablestorage.
+
+    Args:
+        image_entity (dict): The image entity (PartitionKey is the user, RowKey the image ID).
+
+    Returns:
+        dict: The entity to write to the feed table.
+    """
+    entity = {field: image_entity[field] for field in FEED_FIELDS if field in image_entity}
+    entity['PartitionKey'] = FEED_PARTITION
+    entity['RowKey'] = feed_row_key(image_entity['DateAdded'], image_entity['RowKey'])
+    entity['UserId'] = image_entity['PartitionKey']
+    entity['ImageId'] = image_entity['RowKey']
+    return entity
+
+
+def to_image_entity(entity):
+    """
+    Maps a feed row back to the shape of an image entity so it can go through
+    the same conversion as rows from dextablestorage.
+    """
+    image_entity = {field: entity[field] for field in FEED_FIELDS if field in entity}
+    image_entity['PartitionKey'] = entity['UserId']
+    image_entity['RowKey'] = entity['ImageId']
+    return image_entity
+
+
+def backfill(table_client, feed_table_client):
+    """
+    Writes feed rows for every image already in dextablestorage. Safe to re-run.
+
+    Returns:
+        int: The number of feed rows written.
+    """
+    count = 0
+    for entity in table_client.list_entities():
+        if not entity.get('DateAdded'):
+            continue
+        feed_table_client.upsert_entity(feed_entity(entity))
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    from server import table_client, feed_table_client
+    print(f"Backfilled {backfill(table_client, feed_table_client)} feed rows")
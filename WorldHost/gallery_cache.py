@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class InProcessGalleryBackend:
+    """
+    Bounded LRU of per-user gallery entries held in this worker's memory. Entries also expire
+    after ttl seconds so galleries changed through another worker are picked up eventually.
+
+    Generations are kept for every user ever invalidated, not just cached ones: dropping one would
+    let a reader that started before the invalidation see a matching generation again.
+    """
+
+    def __init__(self, max_users=1000, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[0]
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def set(self, user_id, image_infos, generation):
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return False
+            self._entries[user_id] = (image_infos, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+
+class RedisGalleryBackend:
+    """
+    Gallery entries shared by every worker through Redis, so an upload handled by one worker
+    invalidates the cache for all of them. Requires the optional redis package.
+    """
+
+    # Stores the entry only if the user's generation is still the one read before the table query
+    SET_IF_GENERATION = """
+    if (redis.call('get', KEYS[2]) or '0') == ARGV[2] then
+        redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, url, ttl=300, prefix="gallery:", generation_prefix="gallery-generation:"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RedisGalleryBackend requires the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.generation_prefix = generation_prefix
+        self._set_if_generation = self.client.register_script(self.SET_IF_GENERATION)
+
+    def get(self, user_id):
+        value = self.client.get(self.prefix + user_id)
+        return json.loads(value) if value is not None else None
+
+    def generation(self, user_id):
+        return int(self.client.get(self.generation_prefix + user_id) or 0)
+
+    def set(self, user_id, image_infos, generation):
+        keys = [self.prefix + user_id, self.generation_prefix + user_id]
+        return bool(self._set_if_generation(keys=keys, args=[json.dumps(image_infos), generation, self.ttl]))
+
+    def invalidate(self, user_id):
+        # Bump first, so a reader that queried before this can no longer store its result
+        pipeline = self.client.pipeline()
+        pipeline.incr(self.generation_prefix + user_id)
+        pipeline.delete(self.prefix + user_id)
+        pipeline.execute()
+
+
+class GalleryCache:
+    """
+    Caches each user's unsigned gallery entries (see entity_to_image_info) in front of the
+    partition query. The upload path calls invalidate() whenever it writes a row for the user.
+
+    invalidate() also bumps a per-user generation. A reader takes generation() before querying
+    the table and passes it to set(), which stores nothing if an invalidation happened in
+    between, so a slow read can't put a gallery from before an upload back in the cache.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, user_id):
+        """
+        Returns a copy of the cached entries for user_id, or None on a miss. Copies are handed
+        out because callers sign the URLs in place.
+        """
+        image_infos = self.backend.get(user_id)
+        if image_infos is None:
+            return None
+        return [dict(image_info) for image_info in image_infos]
+
+    def generation(self, user_id):
+        return self.backend.generation(user_id)
+
+    def set(self, user_id, image_infos, generation):
+        """
+        Returns:
+            bool: Whether the entries were stored; False if the gallery changed since generation.
+        """
+        return self.backend.set(user_id, [dict(image_info) for image_info in image_infos], generation)
+
+    def invalidate(self, user_id):
+        self.backend.invalidate(user_id)
+
+
+def create_gallery_cache(url=None, max_users=1000, ttl=300):
+    """
+    Builds a GalleryCache on Redis when url is set, otherwise on an in-process LRU.
+    """
+    if url:
+        return GalleryCache(RedisGalleryBackend(url, ttl=ttl))
+    return GalleryCache(InProcessGalleryBackend(max_users=max_users, ttl=ttl))
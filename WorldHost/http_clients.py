@@ -0,0 +1,68 @@
+import threading
+from urllib.parse import urlparse
+import httpx
+
+
+def parse_host_timeouts(spec):
+    """
+    Parses 'host=seconds,host=seconds' into a dict of host -> seconds.
+    """
+    timeouts = {}
+    for entry in (spec or '').split(','):
+        if not entry.strip():
+            continue
+        host, seconds = entry.split('=')
+        timeouts[host.strip().lower()] = float(seconds)
+    return timeouts
+
+
+class HttpClientRegistry:
+    """
+    Long-lived httpx clients, one per remote host, so outbound calls reuse pooled HTTP/2 and
+    keep-alive connections instead of paying TCP and TLS setup on every request.
+
+    Each host gets its own read timeout from host_timeouts, falling back to default_timeout, so a
+    slow upload endpoint doesn't force long timeouts on quick API lookups.
+    """
+
+    def __init__(self, default_timeout=10.0, host_timeouts=None, connect_timeout=5.0,
+                 max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0, http2=True):
+        self.default_timeout = default_timeout
+        self.host_timeouts = host_timeouts or {}
+        self.connect_timeout = connect_timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def timeout_for(self, host):
+        seconds = self.host_timeouts.get(host, self.default_timeout)
+        return httpx.Timeout(seconds, connect=min(self.connect_timeout, seconds))
+
+    def for_url(self, url):
+        """
+        Returns the client for url's host, creating it on first use.
+        """
+        host = urlparse(url).hostname.lower()
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(timeout=self.timeout_for(host), limits=self.limits, http2=self.http2)
+                self._clients[host] = client
+            return client
+
+    def open(self, *urls):
+        # Creates the clients for hosts known at startup, so the first requests don't race to do it
+        for url in urls:
+            self.for_url(url)
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.aclose()
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+
+COUNTER_PARTITION = "counters"
+
+
+class TableBlockIdAllocator:
+    """
+    Hands out sequential IDs from an in-memory range leased from a counter row in Azure Tables.
+
+    Each lease bumps the counter by block_size using an ETag-guarded replace, so any number of
+    workers or hosts can share the counter without a lock; a lost race just re-reads and retries.
+    IDs are unique but only roughly ordered across processes.
+    """
+
+    def __init__(self, table_client, counter_name="image_id", block_size=100, initial_value=0):
+        self.table_client = table_client
+        self.counter_name = counter_name
+        self.block_size = block_size
+        self.initial_value = initial_value
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _lease_block(self):
+        while True:
+            try:
+                entity = self.table_client.get_entity(partition_key=COUNTER_PARTITION, row_key=self.counter_name)
+            except ResourceNotFoundError:
+                try:
+                    self.table_client.create_entity({
+                        'PartitionKey': COUNTER_PARTITION,
+                        'RowKey': self.counter_name,
+                        'NextValue': self.initial_value + self.block_size
+                    })
+                    return self.initial_value, self.initial_value + self.block_size
+                except ResourceExistsError:
+                    continue
+
+            start = int(entity['NextValue'])
+            entity['NextValue'] = start + self.block_size
+            try:
+                self.table_client.update_entity(
+                    entity,
+                    mode=UpdateMode.REPLACE,
+                    etag=entity.metadata['etag'],
+                    match_condition=MatchConditions.IfNotModified
+                )
+                return start, start + self.block_size
+            except ResourceModifiedError:
+                # Another process leased a block first; try again with the new value
+                continue
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._lease_block()
+            value = self._next
+            self._next += 1
+            return str(value)
+
+
+class TimeSortableIdAllocator:
+    """
+    Generates IDs from the current time in milliseconds plus random bits, so they sort by
+    upload time and need no coordination at all.
+    """
+
+    def next_id(self):
+        return f"{int(time.time() * 1000):013d}{os.urandom(5).hex()}"
+
+
+class FileIdAllocator:
+    """
+    The original next_id.txt counter. Only safe with a single worker process; kept for local runs.
+    """
+
+    def __init__(self, path="next_id.txt"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            # Read the current ID
+            with open(self.path, "r") as file:
+                current_id = int(file.read().strip())
+
+            # Increment and save the next ID
+            with open(self.path, "w") as file:
+                file.write(str(current_id + 1))
+
+            return str(current_id)
+
+
+def create_allocator(kind, table_client=None, block_size=100, seed_path="next_id.txt"):
+    """
+    Builds the allocator selected by kind ('table', 'time' or 'file').
+
+    The table allocator starts from the value in seed_path the first time the counter row is
+    created, so switching over from the file allocator keeps IDs increasing.
+    """
+    if kind == "table":
+        initial_value = 0
+        if os.path.exists(seed_path):
+            with open(seed_path, "r") as file:
+                initial_value = int(file.read().strip() or 0)
+        return TableBlockIdAllocator(table_client, block_size=block_size, initial_value=initial_value)
+    if kind == "time":
+        return TimeSortableIdAllocator()
+    if kind == "file":
+        return FileIdAllocator(seed_path)
+    raise ValueError(f"Unknown image ID allocator: {kind}")
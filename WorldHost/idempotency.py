@@ -0,0 +1,110 @@
+import datetime
+import hashlib
+import json
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+
+# Outcomes of IdempotencyStore.claim
+CLAIMED = "claimed"
+COMPLETED = "completed"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+PENDING = "pending"
+DONE = "done"
+
+
+def request_fingerprint(*parts):
+    """
+    Hashes the parts of a request that must match for a retry to reuse its key.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Stored results of requests made with an Idempotency-Key header, one row per (user, key).
+
+    A request claims its key before doing any work and stores its response when it finishes, so a
+    retry gets the first response back instead of repeating the work. A claim left pending for
+    longer than lease seconds, by a worker that died mid-request, can be taken over.
+    """
+
+    def __init__(self, table_client, lease=300, ttl=86400):
+        self.table_client = table_client
+        self.lease = lease
+        self.ttl = ttl
+
+    @staticmethod
+    def _keys(user_id, key):
+        # Keys are client-chosen and may hold characters a RowKey can't
+        return user_id, hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def claim(self, user_id, key, fingerprint):
+        """
+        Returns:
+            tuple: One of CLAIMED, COMPLETED, IN_PROGRESS or MISMATCH, and the stored response
+                for COMPLETED, otherwise None.
+        """
+        partition_key, row_key = self._keys(user_id, key)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        entity = {
+            'PartitionKey': partition_key,
+            'RowKey': row_key,
+            'Status': PENDING,
+            'Fingerprint': fingerprint,
+            'ClaimedAt': now.isoformat()
+        }
+        try:
+            self.table_client.create_entity(entity)
+            return CLAIMED, None
+        except ResourceExistsError:
+            pass
+
+        try:
+            existing = self.table_client.get_entity(partition_key=partition_key, row_key=row_key)
+        except ResourceNotFoundError:
+            # Released between the two calls; let the client retry
+            return IN_PROGRESS, None
+        age = (now - datetime.datetime.fromisoformat(existing['ClaimedAt'])).total_seconds()
+
+        if age > self.ttl:
+            # Keys are only honoured for ttl seconds; an old row is reused as a fresh claim
+            pass
+        elif existing['Fingerprint'] != fingerprint:
+            return MISMATCH, None
+        elif existing['Status'] == DONE:
+            return COMPLETED, json.loads(existing['Response'])
+        elif age <= self.lease:
+            return IN_PROGRESS, None
+
+        try:
+            self.table_client.update_entity(
+                entity, mode=UpdateMode.REPLACE,
+                etag=existing.metadata['etag'], match_condition=MatchConditions.IfNotModified
+            )
+        except (ResourceModifiedError, ResourceNotFoundError):
+            return IN_PROGRESS, None
+        return CLAIMED, None
+
+    def complete(self, user_id, key, response):
+        partition_key, row_key = self._keys(user_id, key)
+        self.table_client.update_entity({
+            'PartitionKey': partition_key,
+            'RowKey': row_key,
+            'Status': DONE,
+            'Response': json.dumps(response)
+        }, mode=UpdateMode.MERGE)
+
+    def release(self, user_id, key):
+        # A failed request gives its key back so the retry can run it again
+        partition_key, row_key = self._keys(user_id, key)
+        try:
+            self.table_client.delete_entity(partition_key=partition_key, row_key=row_key)
+        except ResourceNotFoundError:
+            pass
@@ -0,0 +1,119 @@
+from io import BytesIO
+from PIL import Image, ImageOps
+
+# Longest edge, in pixels, of each thumbnail generated for the gallery grids
+THUMBNAIL_SIZES = (128, 256, 512)
+
+THUMBNAIL_FORMATS = {
+    'WEBP': ('webp', 'image/webp'),
+    'JPEG': ('jpg', 'image/jpeg'),
+}
+
+
+def generate_thumbnails(image_bytes, sizes=THUMBNAIL_SIZES, image_format='WEBP', quality=80):
+    """
+    Downscales an image to a set of fixed sizes. Runs in a worker process, so it only takes
+    and returns plain bytes.
+
+    Args:
+        image_bytes (bytes): The encoded source image.
+        sizes (tuple): Longest-edge sizes to produce, ascending. Sizes above the source's own
+            are skipped, except the first, so every image gets at least one thumbnail.
+        image_format (str): 'WEBP' or 'JPEG'.
+        quality (int): Encoder quality, 1-100.
+
+    Returns:
+        dict: Maps each size to the encoded thumbnail bytes.
+    """
+    with Image.open(BytesIO(image_bytes)) as image:
+        image.load()
+        # JPEG has no alpha channel; WebP keeps it
+        mode = 'RGBA' if image_format == 'WEBP' and image.mode in ('RGBA', 'LA', 'P') else 'RGB'
+        image = image.convert(mode)
+
+        thumbnails = {}
+        for size in sizes:
+            if size > max(image.size) and thumbnails:
+                continue
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            output = BytesIO()
+            thumbnail.save(output, format=image_format, quality=quality)
+            thumbnails[size] = output.getvalue()
+        return thumbnails
+
+
+# Formats images may be re-encoded to on ingest, with their blob extension and content type
+INGEST_FORMATS = {
+    'WEBP': ('webp', 'image/webp'),
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+}
+
+EXTENSIONS_BY_CONTENT_TYPE = {content_type: extension for extension, content_type in INGEST_FORMATS.values()}
+
+
+def ingest_image(image_bytes, max_dimension=2048, image_format='WEBP', quality=85):
+    """
+    Validates an uploaded image, downsamples it so neither edge exceeds max_dimension and
+    re-encodes it. Runs in a worker process, so it only takes and returns plain bytes.
+
+    If re-encoding would not make a small enough image any smaller, the original bytes are kept.
+
+    Args:
+        image_bytes (bytes): The uploaded image.
+        max_dimension (int): Longest edge allowed, in pixels; 0 disables downsampling.
+        image_format (str): One of INGEST_FORMATS.
+        quality (int): Encoder quality, 1-100, for the lossy formats.
+
+    Returns:
+        tuple: The bytes to store, their content type and the blob file extension.
+
+    Raises:
+        ValueError: If the bytes are not an image Pillow can decode.
+    """
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            image.load()
+            original_format = image.format
+            # Camera captures often rely on EXIF orientation, which re-encoding would drop
+            image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        raise ValueError(f"Not a valid image: {e}")
+
+    resized = bool(max_dimension) and max(image.size) > max_dimension
+    if resized:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    encoded = output.getvalue()
+
+    if not resized and len(encoded) >= len(image_bytes):
+        return image_bytes, Image.MIME.get(original_format, 'application/octet-stream'), (original_format or 'bin').lower()
+    extension, content_type = INGEST_FORMATS[image_format]
+    return encoded, content_type, extension
+
+
+# Enough of the start of a file for Pillow to read the header of any format we accept,
+# including JPEGs carrying large EXIF blocks
+SNIFF_BYTES = 1024 * 1024
+
+
+def sniff_content_type(header_bytes):
+    """
+    Identifies an image from the start of its file, reading only the header.
+
+    Returns:
+        str: The content type of the format Pillow recognises, or None if it recognises none.
+    """
+    try:
+        with Image.open(BytesIO(header_bytes)) as image:
+            return Image.MIME.get(image.format)
+    except Exception:
+        return None
@@ -0,0 +1,233 @@
+import base64
+import hashlib
+
+# Multicodec and multihash codes
+RAW = 0x55
+DAG_PB = 0x70
+SHA2_256 = 0x12
+
+# Largest leaf block, matching the IPFS default chunker
+CHUNK_SIZE = 256 * 1024
+
+# UnixFS node types
+UNIXFS_DIRECTORY = 1
+UNIXFS_FILE = 2
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def read_varint(data, offset=0):
+    """
+    Returns:
+        tuple: The decoded value and the offset just past it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def cid_v1(codec, block):
+    """
+    Computes the binary CIDv1 of a block: version, codec and a sha2-256 multihash.
+    """
+    return varint(1) + varint(codec) + varint(SHA2_256) + varint(32) + hashlib.sha256(block).digest()
+
+
+def read_cid(data, offset=0):
+    """
+    Returns:
+        tuple: The binary CID starting at offset, its codec, its digest and the offset just past it.
+    """
+    start = offset
+    version, offset = read_varint(data, offset)
+    if version != 1:
+        raise ValueError(f"Unsupported CID version {version}")
+    codec, offset = read_varint(data, offset)
+    hash_code, offset = read_varint(data, offset)
+    length, offset = read_varint(data, offset)
+    if hash_code != SHA2_256 or length != 32:
+        raise ValueError("Only sha2-256 CIDs are supported")
+    digest = bytes(data[offset:offset + length])
+    offset += length
+    return bytes(data[start:offset]), codec, digest, offset
+
+
+def cid_to_str(cid):
+    # Multibase base32, the form NFT.storage and the gateways use
+    return 'b' + base64.b32encode(cid).decode('ascii').lower().rstrip('=')
+
+
+def _key(number, wire_type):
+    return varint(number << 3 | wire_type)
+
+
+def _bytes_field(number, value):
+    return _key(number, 2) + varint(len(value)) + value
+
+
+def _varint_field(number, value):
+    return _key(number, 0) + varint(value)
+
+
+def encode_pb_node(links, data):
+    """
+    Encodes a dag-pb node. Links are (cid, name, tsize) and, per the dag-pb spec, are written
+    before the data.
+    """
+    encoded_links = b''.join(
+        _bytes_field(2, _bytes_field(1, cid) + _bytes_field(2, name.encode('utf-8')) + _varint_field(3, tsize))
+        for cid, name, tsize in links
+    )
+    return encoded_links + _bytes_field(1, data)
+
+
+def unixfs_data(node_type, filesize=None, blocksizes=()):
+    data = _varint_field(1, node_type)
+    if filesize is not None:
+        data += _varint_field(3, filesize)
+    return data + b''.join(_varint_field(4, size) for size in blocksizes)
+
+
+def rechunk(chunks, size):
+    """
+    Regroups an iterable of byte strings into blocks of exactly size bytes, except the last.
+    Always yields at least one block, so an empty input becomes one empty block.
+    """
+    buffer = bytearray()
+    emitted = False
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+            emitted = True
+    if buffer or not emitted:
+        yield bytes(buffer)
+
+
+class CarFile:
+    """
+    A file to be packed into a CAR as raw leaves under a UnixFS file node.
+
+    The file is read twice, once here to compute its CID and once when the CAR is streamed, so it
+    is given as a callable returning a fresh iterable of its bytes, which must be the same both times.
+    """
+
+    def __init__(self, name, open_chunks):
+        self.name = name
+        self.open_chunks = open_chunks
+        self.leaves = [(cid_v1(RAW, block), len(block)) for block in rechunk(open_chunks(), CHUNK_SIZE)]
+
+        if len(self.leaves) == 1:
+            # A single block is addressed directly as a raw leaf
+            self.root_block = None
+            self.cid = self.leaves[0][0]
+        else:
+            sizes = [size for _, size in self.leaves]
+            links = [(cid, '', size) for cid, size in self.leaves]
+            self.root_block = encode_pb_node(links, unixfs_data(UNIXFS_FILE, sum(sizes), sizes))
+            self.cid = cid_v1(DAG_PB, self.root_block)
+
+        # Total bytes of every block in the file's DAG, as a dag-pb link's Tsize
+        self.tsize = sum(size for _, size in self.leaves) + len(self.root_block or b'')
+
+    def blocks(self):
+        if self.root_block is not None:
+            yield self.cid, self.root_block
+        for (cid, _), block in zip(self.leaves, rechunk(self.open_chunks(), CHUNK_SIZE)):
+            if cid_v1(RAW, block) != cid:
+                raise ValueError(f"{self.name} changed between reads")
+            yield cid, block
+
+
+def car_header(root):
+    # DAG-CBOR {"roots": [root], "version": 1}; CIDs are tag 42 over a 0x00-prefixed byte string
+    cid_bytes = b'\x00' + root
+    header = (
+        b'\xa2'
+        + b'\x65roots' + b'\x81' + b'\xd8\x2a' + b'\x58' + bytes([len(cid_bytes)]) + cid_bytes
+        + b'\x67version' + b'\x01'
+    )
+    return varint(len(header)) + header
+
+
+def car_section(cid, block):
+    return varint(len(cid) + len(block)) + cid + block
+
+
+class CarDirectory:
+    """
+    A UnixFS directory of CarFiles, streamed as a CARv1 file whose root is the directory.
+    """
+
+    def __init__(self, files):
+        # dag-pb requires directory links sorted by name
+        self.files = sorted(files, key=lambda file: file.name.encode('utf-8'))
+        links = [(file.cid, file.name, file.tsize) for file in self.files]
+        self.root_block = encode_pb_node(links, unixfs_data(UNIXFS_DIRECTORY))
+        self.root = cid_v1(DAG_PB, self.root_block)
+        self.header = car_header(self.root)
+
+    def __len__(self):
+        sections = [(self.root, len(self.root_block))]
+        for file in self.files:
+            if file.root_block is not None:
+                sections.append((file.cid, len(file.root_block)))
+            sections.extend(file.leaves)
+        return len(self.header) + sum(len(varint(len(cid) + size)) + len(cid) + size for cid, size in sections)
+
+    def __iter__(self):
+        yield self.header
+        yield car_section(self.root, self.root_block)
+        for file in self.files:
+            for cid, block in file.blocks():
+                yield car_section(cid, block)
+
+
+def read_car(data):
+    """
+    Parses a CARv1 file written by CarDirectory, checking every block against its CID.
+
+    Returns:
+        tuple: The root CID and a dict of CID -> block.
+
+    Raises:
+        ValueError: If the CAR is malformed or a block does not match its CID.
+    """
+    header_length, offset = read_varint(data)
+    header = data[offset:offset + header_length]
+    offset += header_length
+    tag = header.find(b'\xd8\x2a')
+    if tag < 0:
+        raise ValueError("CAR header has no root")
+    root, _, _, _ = read_cid(header, tag + 5)
+
+    blocks = {}
+    while offset < len(data):
+        section_length, offset = read_varint(data, offset)
+        end = offset + section_length
+        cid, _, digest, block_start = read_cid(data, offset)
+        block = bytes(data[block_start:end])
+        if hashlib.sha256(block).digest() != digest:
+            raise ValueError(f"Block {cid_to_str(cid)} does not match its CID")
+        blocks[cid] = block
+        offset = end
+    return root, blocks
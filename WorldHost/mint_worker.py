@@ -0,0 +1,308 @@
+import asyncio
+import datetime
+import threading
+import time
+import uuid
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+from web3.exceptions import InvalidAddress, TransactionNotFound, Web3ValidationError
+
+MINT_PARTITION = "mint"
+# Row in the mint partition holding the lease that picks the one process allowed to mint
+LEADER_ROW = "leader"
+
+# Job states, in the order a job normally moves through them. A job is SUBMITTING from the
+# moment a worker claims it until its transaction is known to have been sent
+QUEUED = "queued"
+SUBMITTING = "submitting"
+SUBMITTED = "submitted"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+
+# Raised while building a job's transaction when its arguments can never encode; retrying won't help
+BUILD_ERRORS = (InvalidAddress, Web3ValidationError, TypeError)
+
+
+class NonceManager:
+    """
+    Assigns sequential nonces for the minting wallet locally. The chain is only asked for the
+    pending transaction count on first use and after reset(), not once per mint.
+    """
+
+    def __init__(self, web3, address):
+        self.web3 = web3
+        self.address = address
+        self._next = None
+        self._lock = threading.Lock()
+
+    def next_nonce(self):
+        with self._lock:
+            if self._next is None:
+                self._next = self.web3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def reset(self):
+        # Called after a failed send so the next nonce is re-read and no gap is left behind
+        with self._lock:
+            self._next = None
+
+
+class MintQueue:
+    """
+    Persistent queue of mint jobs stored as rows in an Azure table. Job IDs start with a
+    timestamp so queued jobs are picked up oldest first.
+    """
+
+    def __init__(self, table_client):
+        self.table_client = table_client
+
+    def enqueue(self, cid, user_address):
+        job_id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        self.table_client.create_entity({
+            'PartitionKey': MINT_PARTITION,
+            'RowKey': job_id,
+            'Cid': cid,
+            'UserAddress': user_address,
+            'Status': QUEUED,
+            'Attempts': 0,
+            'CreatedAt': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        })
+        return job_id
+
+    def get(self, job_id):
+        try:
+            return self.table_client.get_entity(partition_key=MINT_PARTITION, row_key=job_id)
+        except ResourceNotFoundError:
+            return None
+
+    def with_status(self, status, limit):
+        filter_query = f"PartitionKey eq '{MINT_PARTITION}' and Status eq '{status}'"
+        jobs = []
+        for entity in self.table_client.query_entities(filter_query, results_per_page=limit):
+            jobs.append(entity)
+            if len(jobs) >= limit:
+                break
+        return jobs
+
+    def update(self, job_id, **fields):
+        fields['PartitionKey'] = MINT_PARTITION
+        fields['RowKey'] = job_id
+        self.table_client.update_entity(fields, mode=UpdateMode.MERGE)
+
+    def claim(self, job):
+        """
+        Moves a queued job to SUBMITTING, only if nobody has changed it since it was read.
+
+        Returns:
+            bool: Whether this caller now owns the job.
+        """
+        try:
+            self.table_client.update_entity(
+                {'PartitionKey': MINT_PARTITION, 'RowKey': job['RowKey'], 'Status': SUBMITTING},
+                mode=UpdateMode.MERGE, etag=job.metadata['etag'], match_condition=MatchConditions.IfNotModified
+            )
+        except (ResourceModifiedError, ResourceNotFoundError):
+            return False
+        return True
+
+    def acquire_lease(self, owner, duration):
+        """
+        Takes or renews the leader lease for owner. The lease is only taken over once the
+        current holder has let it lapse for duration seconds.
+
+        Returns:
+            bool: Whether owner holds the lease.
+        """
+        now = time.time()
+        lease = {'PartitionKey': MINT_PARTITION, 'RowKey': LEADER_ROW, 'Owner': owner, 'ExpiresAt': now + duration}
+        try:
+            current = self.table_client.get_entity(partition_key=MINT_PARTITION, row_key=LEADER_ROW)
+        except ResourceNotFoundError:
+            try:
+                self.table_client.create_entity(lease)
+            except ResourceExistsError:
+                return False
+            return True
+
+        if current['Owner'] != owner and current['ExpiresAt'] > now:
+            return False
+        try:
+            self.table_client.update_entity(
+                lease, mode=UpdateMode.REPLACE,
+                etag=current.metadata['etag'], match_condition=MatchConditions.IfNotModified
+            )
+        except (ResourceModifiedError, ResourceNotFoundError):
+            return False
+        return True
+
+
+class MintWorker:
+    """
+    Drains the mint queue in the background. Each tick signs and sends up to batch_size queued
+    jobs back to back with locally assigned nonces, without waiting for any of them to be mined,
+    and then checks receipts for jobs submitted earlier.
+
+    Nonces are assigned locally, so only the process holding the leader lease in the queue table
+    mints; workers in other processes idle until the lease lapses. Each job is also claimed with an
+    ETag-guarded update, and its nonce and transaction hash are stored before it is sent, so a job
+    is never sent twice. A job whose send fails stays SUBMITTING, since the node may still have
+    accepted it; only a transaction the node no longer knows about after submit_timeout seconds is
+    treated as dropped and its job re-queued.
+    """
+
+    def __init__(self, queue, web3, contract, wallet_address, private_key, chain_id,
+                 batch_size=10, poll_interval=2.0, max_attempts=3, gas=2000000, gas_price_gwei='50',
+                 signing_executor=None, lease_duration=60.0, submit_timeout=600.0):
+        self.queue = queue
+        self.web3 = web3
+        self.contract = contract
+        self.wallet_address = wallet_address
+        self.private_key = private_key
+        self.chain_id = chain_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.gas = gas
+        self.gas_price = web3.to_wei(gas_price_gwei, 'gwei')
+        self.nonces = NonceManager(web3, wallet_address)
+        # Optional executor the signing is handed to, so it is counted with the other crypto work
+        self.signing_executor = signing_executor
+        self.worker_id = uuid.uuid4().hex
+        self.lease_duration = lease_duration
+        self.submit_timeout = submit_timeout
+
+    def sign_mint(self, job, nonce):
+        txn = self.contract.functions.mintNFT(job['UserAddress'], f"ipfs://{job['Cid']}").build_transaction({
+            'from': self.wallet_address,
+            'chainId': self.chain_id,
+            'gas': self.gas,
+            'gasPrice': self.gas_price,
+            'nonce': nonce,
+        })
+        return self.web3.eth.account.sign_transaction(txn, private_key=self.private_key)
+
+    def submit_queued(self):
+        for job in self.queue.with_status(QUEUED, self.batch_size):
+            if not self.queue.claim(job):
+                continue
+            job_id = job['RowKey']
+            attempts = job.get('Attempts', 0) + 1
+            try:
+                nonce = self.nonces.next_nonce()
+            except Exception as e:
+                # The node is unreachable, so the rest of the batch would fail the same way
+                self.queue.update(job_id, Status=QUEUED, Error=str(e))
+                break
+
+            try:
+                # Counted before building, so a job that can never be built runs out of attempts
+                # instead of being reclaimed on every tick
+                self.queue.update(job_id, Attempts=attempts)
+                if self.signing_executor is not None:
+                    signed_txn = self.signing_executor.submit(self.sign_mint, job, nonce).result()
+                else:
+                    signed_txn = self.sign_mint(job, nonce)
+                # Recorded before sending, so a job whose send can't be confirmed is tracked by
+                # its hash in check_submitted instead of being sent again
+                self.queue.update(
+                    job_id, Nonce=nonce, TransactionHash=signed_txn.hash.hex(),
+                    SubmittedAt=datetime.datetime.now(datetime.timezone.utc).isoformat()
+                )
+            except Exception as e:
+                # The nonce was never used, so hand it back before the next job takes one
+                self.nonces.reset()
+                failed = isinstance(e, BUILD_ERRORS) or attempts >= self.max_attempts
+                self.queue.update(job_id, Status=FAILED if failed else QUEUED, Error=str(e))
+                continue
+
+            try:
+                self.web3.eth.send_raw_transaction(signed_txn.rawTransaction)
+            except Exception as e:
+                # A timeout or "already known" doesn't mean the node rejected it, so the job stays
+                # SUBMITTING and check_submitted decides from its hash. Later nonces may be stuck
+                # behind this one, so stop the batch and re-read the nonce from the chain
+                self.nonces.reset()
+                try:
+                    self.queue.update(job_id, Error=str(e))
+                except Exception:
+                    pass
+                break
+
+            try:
+                self.queue.update(job_id, Status=SUBMITTED)
+            except Exception:
+                # Still SUBMITTING with its hash stored; check_submitted finishes it either way
+                pass
+
+    def check_submitted(self):
+        jobs = self.queue.with_status(SUBMITTED, self.batch_size * 5) + self.queue.with_status(SUBMITTING, self.batch_size)
+        for job in jobs:
+            if not job.get('TransactionHash'):
+                # Claimed by a worker that stopped before signing; nothing can have been sent
+                if self._expired(job.get('SubmittedAt'), job.metadata.get('timestamp')):
+                    self.queue.update(job['RowKey'], Status=QUEUED)
+                continue
+            try:
+                receipt = self.web3.eth.get_transaction_receipt(job['TransactionHash'])
+            except TransactionNotFound:
+                self._requeue_if_dropped(job)
+                continue
+            self.queue.update(job['RowKey'], Status=CONFIRMED if receipt['status'] == 1 else FAILED)
+
+    def _expired(self, submitted_at, fallback=None):
+        if submitted_at:
+            started = datetime.datetime.fromisoformat(submitted_at)
+        elif fallback is not None:
+            started = fallback
+        else:
+            return False
+        return (datetime.datetime.now(datetime.timezone.utc) - started).total_seconds() > self.submit_timeout
+
+    def _requeue_if_dropped(self, job):
+        # No receipt just means not mined yet; only a transaction the node has forgotten is dropped
+        if not self._expired(job.get('SubmittedAt')):
+            return
+        try:
+            self.web3.eth.get_transaction(job['TransactionHash'])
+            return
+        except TransactionNotFound:
+            pass
+        # Its nonce was never used, so later transactions are stuck behind it until it is re-sent
+        self.nonces.reset()
+        attempts = job.get('Attempts', 0)
+        status = FAILED if attempts >= self.max_attempts else QUEUED
+        self.queue.update(job['RowKey'], Status=status, Error="Transaction was dropped")
+
+    def tick(self):
+        if not self.queue.acquire_lease(self.worker_id, self.lease_duration):
+            # Another process is minting and moving the nonce on; re-read it if the lease comes here
+            self.nonces.reset()
+            return
+        self.submit_queued()
+        self.check_submitted()
+
+    async def run(self):
+        # The web3 and table clients are blocking, so each tick runs in a worker thread
+        while True:
+            try:
+                await asyncio.to_thread(self.tick)
+            except Exception:
+                # A transient RPC or storage error shouldn't stop the worker; retry next tick
+                pass
+            await asyncio.sleep(self.poll_interval)
+
+
+def job_status(job):
+    """
+    Converts a mint job row into the response returned by the status endpoints.
+    """
+    return {
+        "job_id": job['RowKey'],
+        "status": job['Status'],
+        "transaction_hash": job.get('TransactionHash'),
+        "attempts": job.get('Attempts', 0),
+        "error": job.get('Error')
+    }
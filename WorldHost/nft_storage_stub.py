@@ -0,0 +1,44 @@
+from fastapi import FastAPI, HTTPException, Request, Response
+from ipfs_car import RAW, cid_v1, cid_to_str, read_car
+
+# Local stand-in for the NFT.storage upload API, for running the decentralized upload without
+# the real service. Start it with `uvicorn nft_storage_stub:app --port 8081` and set
+# NFT_STORAGE_API_URL=http://localhost:8081 for server.py. Blocks are kept in memory only.
+app = FastAPI()
+
+blocks = {}
+
+
+@app.post("/upload")
+async def upload(request: Request):
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing API key")
+
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/car"):
+        try:
+            root, car_blocks = read_car(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if root not in car_blocks:
+            raise HTTPException(status_code=400, detail="CAR does not contain its root block")
+        blocks.update((cid_to_str(cid), block) for cid, block in car_blocks.items())
+    else:
+        # Plain uploads are stored as a single raw block, which only holds for small files
+        form = await request.form()
+        upload_file = form.get("file")
+        if upload_file is None:
+            raise HTTPException(status_code=400, detail="No file in the upload")
+        data = await upload_file.read()
+        root = cid_v1(RAW, data)
+        blocks[cid_to_str(root)] = data
+
+    return {"ok": True, "value": {"cid": cid_to_str(root)}}
+
+
+@app.get("/ipfs/{cid}")
+async def get_block(cid: str):
+    # Returns the block itself; directories and multi-block files are not resolved
+    if cid not in blocks:
+        raise HTTPException(status_code=404, detail="Block not found")
+    return Response(content=blocks[cid], media_type="application/octet-stream")
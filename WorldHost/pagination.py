@@ -0,0 +1,73 @@
+import base64
+import json
+
+# Azure Tables rejects a $top above 1000, so no single request asks for more
+MAX_RESULTS_PER_REQUEST = 1000
+
+
+def encode_continuation_token(token):
+    """
+    Turns an Azure Tables continuation token into an opaque string that is safe to hand to clients.
+
+    Args:
+        token (dict): The continuation token returned by a table pager, or None.
+
+    Returns:
+        str: A URL-safe string, or None when there are no more pages.
+    """
+    if not token:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(token).encode('utf-8')).decode('ascii')
+
+
+def decode_continuation_token(token):
+    """
+    Reverses encode_continuation_token.
+
+    Args:
+        token (str): The opaque token previously handed to a client, or None.
+
+    Returns:
+        dict: The Azure Tables continuation token, or None for the first page.
+
+    Raises:
+        ValueError: If the token was not produced by encode_continuation_token.
+    """
+    if not token:
+        return None
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid continuation token")
+    if not isinstance(decoded, dict):
+        raise ValueError("Invalid continuation token")
+    return decoded
+
+
+def read_page(query, page_size, continuation_token=None):
+    """
+    Reads up to page_size entities from a table query, following continuation tokens
+    only as far as needed to fill the page. Pages larger than MAX_RESULTS_PER_REQUEST
+    take several requests.
+
+    Args:
+        query (callable): Called with the number of rows still wanted, capped at
+            MAX_RESULTS_PER_REQUEST; returns the
+            ItemPaged from query_entities/list_entities issued with that results_per_page.
+        page_size (int): Number of entities to return.
+        continuation_token (dict): Where to resume, as returned by a previous call.
+
+    Returns:
+        tuple: The list of entities and the continuation token for the next page (None when done).
+    """
+    entities = []
+    token = continuation_token
+    while len(entities) < page_size:
+        pages = query(min(page_size - len(entities), MAX_RESULTS_PER_REQUEST)).by_page(continuation_token=token)
+        page = next(pages, None)
+        if page is not None:
+            entities.extend(page)
+        token = pages.continuation_token
+        if not token:
+            break
+    return entities, token
@@ -2,20 +2,27 @@ from hexbytes import HexBytes
 from coincurve import PublicKey as CCPublicKey
 from eth_account._utils.signing import to_standard_v
 from eth_account._utils.legacy_transactions import serializable_unsigned_transaction_from_dict
-from eth_keys.datatypes import Signature
+from eth_keys.datatypes import Signature, PublicKey
 from eth_rlp import HashableRLP
-from web3 import Web3
-import requests
+from web3 import Web3, AsyncWeb3
+import httpx
+import asyncio
+import aiohttp
 import base64
 from base64 import b64encode
 from ecies import encrypt, decrypt
 from ecies.utils import generate_eth_key
 from cryptography.fernet import Fernet
+from segmented_cipher import generate_key, encrypt_segments, decrypt_segments, is_segmented, MAGIC
+from collections import OrderedDict
+import threading
+import json
 import os
 
 def encrypt_image(image_data_bytes, eth_public_key_hex, output_encrypted_image_path='encrypted_image.enc'):
     """
     Encrypts an image using a symmetric key and then encrypts the key using an Ethereum public key.
+    The image is written as AES-GCM segments (see segmented_cipher) rather than one Fernet token.
 
     Args:
         image_data_bytes (bytes): Image data in bytes.
@@ -25,16 +32,13 @@ def encrypt_image(image_data_bytes, eth_public_key_hex, output_encrypted_image_p
     Returns:
         str: Hexadecimal representation of the encrypted symmetric key.
     """
-    # Generate a symmetric key for Fernet encryption
-    symmetric_key = Fernet.generate_key()
-    cipher_suite = Fernet(symmetric_key)
+    # Generate a symmetric key for AES-GCM encryption
+    symmetric_key = generate_key()
 
-    # Encrypt the image
-    encrypted_image = cipher_suite.encrypt(image_data_bytes)
-
-    # Save the encrypted image to a file
+    # Encrypt the image straight into the file, one segment at a time
     with open(output_encrypted_image_path, 'wb') as encrypted_image_file:
-        encrypted_image_file.write(encrypted_image)
+        for segment in encrypt_segments(symmetric_key, image_data_bytes):
+            encrypted_image_file.write(segment)
 
     # Encrypt the symmetric key using the Ethereum public key
     encrypted_symmetric_key = encrypt(eth_public_key_hex, symmetric_key)
@@ -42,6 +46,109 @@ def encrypt_image(image_data_bytes, eth_public_key_hex, output_encrypted_image_p
     return encrypted_symmetric_key.hex()
 
 
+class FilePublicKeyStore:
+    """
+    Persists address -> public key hex mappings in a JSON file on local disk.
+    """
+
+    def __init__(self, path='public_keys.json'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as store_file:
+            return json.load(store_file)
+
+    def get(self, eth_address):
+        with self._lock:
+            return self._load().get(eth_address)
+
+    def set(self, eth_address, public_key_hex):
+        with self._lock:
+            keys = self._load()
+            keys[eth_address] = public_key_hex
+            # Write to a temporary file first so a crash never leaves a truncated store
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as store_file:
+                json.dump(keys, store_file)
+            os.replace(temp_path, self.path)
+
+
+class TablePublicKeyStore:
+    """
+    Persists address -> public key hex mappings as rows in an Azure table, shared by every worker.
+    """
+
+    PARTITION = 'pubkey'
+
+    def __init__(self, table_client):
+        self.table_client = table_client
+
+    def get(self, eth_address):
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            entity = self.table_client.get_entity(partition_key=self.PARTITION, row_key=eth_address, select=['PublicKey'])
+        except ResourceNotFoundError:
+            return None
+        return entity['PublicKey']
+
+    def set(self, eth_address, public_key_hex):
+        self.table_client.upsert_entity({
+            'PartitionKey': self.PARTITION,
+            'RowKey': eth_address,
+            'PublicKey': public_key_hex
+        })
+
+
+class PublicKeyCache:
+    """
+    In-memory LRU of recovered public keys in front of an optional persistent store.
+
+    An address's public key never changes, so entries never expire; they are only
+    evicted from memory when more than max_entries addresses have been seen.
+    """
+
+    def __init__(self, store=None, max_entries=1024):
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, eth_address):
+        """
+        Returns the cached eth_keys PublicKey for eth_address, or None if it has not been recovered yet.
+        """
+        eth_address = eth_address.lower()
+        with self._lock:
+            if eth_address in self._entries:
+                self._entries.move_to_end(eth_address)
+                return self._entries[eth_address]
+
+        if self.store is None:
+            return None
+        public_key_hex = self.store.get(eth_address)
+        if public_key_hex is None:
+            return None
+        public_key = PublicKey(HexBytes(public_key_hex))
+        self._remember(eth_address, public_key)
+        return public_key
+
+    def set(self, eth_address, public_key):
+        eth_address = eth_address.lower()
+        self._remember(eth_address, public_key)
+        if self.store is not None:
+            self.store.set(eth_address, public_key.to_hex())
+
+    def _remember(self, eth_address, public_key):
+        with self._lock:
+            self._entries[eth_address] = public_key
+            self._entries.move_to_end(eth_address)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
 def get_most_recent_txid(eth_address, api_key, chain):
     """Fetches the most recent transaction ID for a given Ethereum address.
 
@@ -52,11 +159,17 @@ def get_most_recent_txid(eth_address, api_key, chain):
     Returns:
         str: The transaction ID of the most recent transaction.
     """
+    response = get_http_client().get(etherscan_api_url(chain), params=txlist_params(eth_address, api_key))
+    return txid_from_txlist(response.json())
+
+def etherscan_api_url(chain):
     if chain == "SEP":
-      etherscan_api_url = "https://api-sepolia.etherscan.io/api"
-    else:
-      etherscan_api_url = "https://api.etherscan.io/api"
-    params = {
+      return "https://api-sepolia.etherscan.io/api"
+    return "https://api.etherscan.io/api"
+
+def txlist_params(eth_address, api_key):
+    # Only the newest transaction is needed to recover the sender's public key
+    return {
         'module': 'account',
         'action': 'txlist',
         'address': eth_address,
@@ -68,9 +181,7 @@ def get_most_recent_txid(eth_address, api_key, chain):
         'apikey': api_key
     }
 
-    response = requests.get(etherscan_api_url, params=params)
-    data = response.json()
-
+def txid_from_txlist(data):
     if data['status'] == '1' and data['message'] == 'OK' and len(data['result']) > 0:
         return data['result'][0]['hash']
     else:
@@ -79,6 +190,19 @@ def get_most_recent_txid(eth_address, api_key, chain):
 def pub_key_from_tx_eth(txid, chain, web3provider):
     w3test = Web3(Web3.HTTPProvider(web3provider))
     transaction = w3test.eth.get_transaction(txid)
+    return pub_key_from_transaction(transaction, chain)
+
+def pub_key_from_transaction(transaction, chain):
+    """
+    Recovers the sender's public key from a fetched transaction's signature.
+
+    Args:
+        transaction (AttributeDict): The transaction as returned by eth.get_transaction.
+        chain (str): The blockchain network (e.g., 'SEP' for Sepolia).
+
+    Returns:
+        tuple: A tuple containing the public key and the corresponding Ethereum address.
+    """
     chain_id = "0xAA36A7" if chain == "SEP" else "0x01"  # Use integer value for chain ID
 
     # Determine if it's an EIP-1559 transaction
@@ -119,11 +243,11 @@ def pub_key_from_tx_eth(txid, chain, web3provider):
 
     # Verify the recovered address
     if rec_pub.to_checksum_address() != transaction['from']:
-        raise ValueError("Unable to obtain public key from transaction: " + txid)
+        raise ValueError("Unable to obtain public key from transaction: " + HexBytes(transaction['hash']).hex())
 
     return rec_pub, rec_pub.to_checksum_address()
   
-def eth_address_to_pub_key(eth_address, api_key, chain, web3provider):
+def eth_address_to_pub_key(eth_address, api_key, chain, web3provider, cache=None):
     """
     Converts a Sepolia Ethereum address into a public key by finding the most recent transaction ID
     and then using it to obtain the public key.
@@ -132,10 +256,16 @@ def eth_address_to_pub_key(eth_address, api_key, chain, web3provider):
         eth_address (str): The Ethereum address.
         api_key (str): The API key for Etherscan.
         chain (str): The blockchain network (e.g., 'SEP' for Sepolia).
+        cache (PublicKeyCache): Optional cache consulted before, and filled after, recovery.
 
     Returns:
         tuple: A tuple containing the public key and the corresponding Ethereum address.
     """
+    if cache is not None:
+        public_key = cache.get(eth_address)
+        if public_key is not None:
+            return public_key, public_key.to_checksum_address()
+
     try:
         # Get the most recent transaction ID for the given Ethereum address
         txid = get_most_recent_txid(eth_address, api_key, chain)
@@ -143,10 +273,136 @@ def eth_address_to_pub_key(eth_address, api_key, chain, web3provider):
         # Obtain the public key from the Ethereum transaction
         public_key, derived_address = pub_key_from_tx_eth(txid, chain, web3provider)
 
+        if cache is not None:
+            cache.set(eth_address, public_key)
+
         return public_key, derived_address
     except Exception as e:
         raise Exception(f"Error in processing: {e}")
       
+# Shared clients, created on first use so every call reuses pooled keep-alive (and, where the
+# server offers it, HTTP/2) connections instead of paying TCP and TLS setup each time
+ASYNC_HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+_http_client = None
+_async_http_client = None
+_async_web3_clients = {}
+_web3_sessions = []
+_http_client_registry = None
+
+def use_http_client_registry(registry):
+    # Routes the async Etherscan calls through an app's HttpClientRegistry instead of a separate pool
+    global _http_client_registry
+    _http_client_registry = registry
+
+def get_http_client():
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.Client(timeout=ASYNC_HTTP_TIMEOUT, limits=HTTP_LIMITS, http2=True)
+    return _http_client
+
+def get_async_http_client(url=None):
+    global _async_http_client
+    if _http_client_registry is not None and url is not None:
+        return _http_client_registry.for_url(url)
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(timeout=ASYNC_HTTP_TIMEOUT, limits=HTTP_LIMITS, http2=True)
+    return _async_http_client
+
+async def get_async_web3(web3provider):
+    if web3provider not in _async_web3_clients:
+        provider = AsyncWeb3.AsyncHTTPProvider(web3provider, request_kwargs={'timeout': 10})
+        # Hand the provider a session we own, so aclose_async_clients can close it
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        await provider.cache_async_session(session)
+        _web3_sessions.append(session)
+        _async_web3_clients[web3provider] = AsyncWeb3(provider)
+    return _async_web3_clients[web3provider]
+
+async def aclose_async_clients():
+    """Closes every client this module opened: the sync and async httpx pools and the web3 sessions."""
+    global _http_client, _async_http_client
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
+    _async_web3_clients.clear()
+    while _web3_sessions:
+        await _web3_sessions.pop().close()
+
+async def with_retries(call, retries=2, backoff=0.25):
+    """
+    Awaits call(), retrying transient network failures with exponential backoff.
+
+    Args:
+        call (callable): Returns a new awaitable on each attempt.
+        retries (int): How many retries are allowed after the first attempt.
+        backoff (float): Seconds to wait before the first retry; doubled each time.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except (httpx.TransportError, asyncio.TimeoutError, OSError):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff * (2 ** attempt))
+
+async def async_get_most_recent_txid(eth_address, api_key, chain, http_client=None, retries=2):
+    """Async version of get_most_recent_txid using the shared pooled client."""
+    http_client = http_client or get_async_http_client(etherscan_api_url(chain))
+
+    async def fetch():
+        response = await http_client.get(etherscan_api_url(chain), params=txlist_params(eth_address, api_key))
+        response.raise_for_status()
+        return response.json()
+
+    return txid_from_txlist(await with_retries(fetch, retries))
+
+async def async_eth_address_to_pub_key(eth_address, api_key, chain, web3provider, cache=None, http_client=None, retries=2, timeout=20.0, executor=None):
+    """
+    Async version of eth_address_to_pub_key that can be awaited from a request handler.
+
+    Args:
+        eth_address (str): The Ethereum address.
+        api_key (str): The API key for Etherscan.
+        chain (str): The blockchain network (e.g., 'SEP' for Sepolia).
+        web3provider (str): URL of the JSON-RPC endpoint.
+        cache (PublicKeyCache): Optional cache consulted before, and filled after, recovery.
+        http_client (httpx.AsyncClient): Client for Etherscan; defaults to the shared one.
+        retries (int): Retry budget for each network call.
+        timeout (float): Overall deadline in seconds for the lookup.
+        executor (concurrent.futures.Executor): Where the signature recovery runs; defaults to
+            the event loop's default thread pool.
+
+    Returns:
+        tuple: A tuple containing the public key and the corresponding Ethereum address.
+    """
+    if cache is not None:
+        # The cache may be backed by a blocking store, so look it up off the event loop
+        public_key = await asyncio.to_thread(cache.get, eth_address)
+        if public_key is not None:
+            return public_key, public_key.to_checksum_address()
+
+    async def lookup():
+        txid = await async_get_most_recent_txid(eth_address, api_key, chain, http_client, retries)
+        w3 = await get_async_web3(web3provider)
+        transaction = await with_retries(lambda: w3.eth.get_transaction(txid), retries)
+        # secp256k1 recovery is CPU-bound, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, pub_key_from_transaction, transaction, chain)
+
+    try:
+        public_key, derived_address = await asyncio.wait_for(lookup(), timeout)
+    except Exception as e:
+        raise Exception(f"Error in processing: {e}")
+
+    if cache is not None:
+        await asyncio.to_thread(cache.set, eth_address, public_key)
+
+    return public_key, derived_address
+      
 def encrypt_image_with_eth_address(eth_address, api_key, chain, image_data_bytes, web3provider, output_encrypted_image_path='encrypted_image.enc'):
     """
     Encrypts an image using a public key derived from an Ethereum address.
@@ -181,8 +437,27 @@ def decrypt_image(eth_private_key_hex, encrypted_symmetric_key_b64, encrypted_im
     # Decrypt the symmetric key with the Ethereum private key
     decrypted_symmetric_key = decrypt(eth_private_key_hex, encrypted_symmetric_key)
 
-    # Read the encrypted image
     with open(encrypted_image_path, 'rb') as encrypted_image_file:
+        if is_segmented(encrypted_image_file.read(len(MAGIC))):
+            # Decrypt segment by segment, so neither file is ever held in memory whole. Segments
+            # are written to a temporary file that only replaces the output once the final one
+            # verifies, so a tampered or truncated input never leaves partial plaintext behind
+            encrypted_image_file.seek(0)
+            chunks = iter(lambda: encrypted_image_file.read(64 * 1024), b'')
+            temp_path = f"{output_decrypted_image_path}.tmp"
+            try:
+                with open(temp_path, 'wb') as decrypted_image_file:
+                    for segment in decrypt_segments(decrypted_symmetric_key, chunks):
+                        decrypted_image_file.write(segment)
+                os.replace(temp_path, output_decrypted_image_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            return
+
+        # Images encrypted before the segmented format are a single Fernet token
+        encrypted_image_file.seek(0)
         encrypted_image_data = encrypted_image_file.read()
 
     # Decrypt the image with the symmetric key
@@ -0,0 +1,119 @@
+import datetime
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+
+# How long the read-only links we hand out stay valid
+SAS_LIFETIME = datetime.timedelta(days=1)
+SAS_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def blob_path_from_url(blob_url):
+    """
+    Splits a blob URL into its container and blob name.
+
+    Args:
+        blob_url (str): e.g. https://account.blob.core.windows.net/container/name.png
+
+    Returns:
+        tuple: The container name and the blob name.
+    """
+    blob_path = urlparse(blob_url).path.lstrip('/')
+    container_name, blob_name = blob_path.split('/', 1)
+    return container_name, blob_name
+
+
+class SasCache:
+    """
+    Bounded LRU of signed blob URLs keyed by blob path. An entry is handed back only while
+    its token has more than min_remaining lifetime left, so callers never receive a link
+    that is about to expire.
+    """
+
+    def __init__(self, max_entries=10000, min_remaining=datetime.timedelta(hours=1)):
+        self.max_entries = max_entries
+        self.min_remaining = min_remaining
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob_path, now):
+        """
+        Returns the cached signed URL for blob_path, or None if it is missing or too close to expiry.
+        """
+        with self._lock:
+            entry = self._entries.get(blob_path)
+            if entry is None or entry[1] - now <= self.min_remaining:
+                if entry is not None:
+                    del self._entries[blob_path]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(blob_path)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, blob_path, signed_url, expiry):
+        with self._lock:
+            self._entries[blob_path] = (signed_url, expiry)
+            self._entries.move_to_end(blob_path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+class BulkSasSigner:
+    """
+    Signs read-only SAS URLs for a batch of blobs. The validity window, permission and
+    formatted timestamps are computed once when the signer is created, so a request that
+    signs a whole page only pays for the HMAC of each blob. With a SasCache, blobs that
+    still hold a fresh enough token are not re-signed at all.
+    """
+
+    def __init__(self, account_name, account_key, lifetime=SAS_LIFETIME, cache=None):
+        self.account_name = account_name
+        self.account_key = account_key
+        self.cache = cache
+        self.start = datetime.datetime.now(datetime.timezone.utc)
+        self.expiry = self.start + lifetime
+        self._start = self.start.strftime(SAS_TIME_FORMAT)
+        self._expiry = self.expiry.strftime(SAS_TIME_FORMAT)
+        self._permission = BlobSasPermissions(read=True)
+
+    def sign(self, blob_url):
+        """
+        Appends a read-only SAS token to blob_url. Empty URLs are returned unchanged.
+        """
+        if not blob_url:
+            return blob_url
+        container_name, blob_name = blob_path_from_url(blob_url)
+        blob_path = f"{container_name}/{blob_name}"
+        if self.cache is not None:
+            cached_url = self.cache.get(blob_path, self.start)
+            if cached_url is not None:
+                return cached_url
+
+        sas_token = generate_blob_sas(
+            account_name=self.account_name,
+            container_name=container_name,
+            blob_name=blob_name,
+            account_key=self.account_key,
+            permission=self._permission,
+            expiry=self._expiry,
+            start=self._start
+        )
+        signed_url = f"{blob_url}?{sas_token}"
+        if self.cache is not None:
+            self.cache.put(blob_path, signed_url, self.expiry)
+        return signed_url
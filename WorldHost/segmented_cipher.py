@@ -0,0 +1,120 @@
+import os
+import struct
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Encrypted images are a header followed by AES-256-GCM segments. Each segment's nonce is a
+# random per-file prefix, the segment counter and a final-segment flag, so segments can't be
+# reordered, dropped or truncated without the tag check failing
+MAGIC = b'WDXS'
+VERSION = 1
+SEGMENT_SIZE = 64 * 1024
+KEY_BYTES = 32
+NONCE_PREFIX_BYTES = 7
+TAG_BYTES = 16
+
+# magic, version, plaintext segment size, nonce prefix
+_HEADER = struct.Struct(f'>4sBI{NONCE_PREFIX_BYTES}s')
+HEADER_BYTES = _HEADER.size
+
+# Recorded in the NFT metadata so readers know how to decrypt the image
+ENCRYPTION_SCHEME = 'aes-256-gcm-segmented-v1'
+
+
+def generate_key():
+    return AESGCM.generate_key(bit_length=KEY_BYTES * 8)
+
+
+def generate_nonce_prefix():
+    return os.urandom(NONCE_PREFIX_BYTES)
+
+
+def is_segmented(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _nonce(prefix, counter, final):
+    return prefix + struct.pack('>IB', counter, 1 if final else 0)
+
+
+def encrypt_segments(key, plaintext, segment_size=SEGMENT_SIZE, nonce_prefix=None):
+    """
+    Encrypts plaintext one segment at a time.
+
+    Args:
+        key (bytes): 32-byte AES key.
+        plaintext (bytes): The data to encrypt; sliced, not copied.
+        segment_size (int): Plaintext bytes per segment.
+        nonce_prefix (bytes): Fixes the nonce prefix, so the same key and plaintext encrypt to the
+            same bytes when the ciphertext has to be produced twice. Never reuse one for other data.
+
+    Yields:
+        bytes: The header, then each encrypted segment with its tag.
+    """
+    aesgcm = AESGCM(key)
+    prefix = nonce_prefix or generate_nonce_prefix()
+    header = _HEADER.pack(MAGIC, VERSION, segment_size, prefix)
+    yield header
+
+    view = memoryview(plaintext)
+    counter = 0
+    offset = 0
+    while True:
+        segment = view[offset:offset + segment_size]
+        offset += segment_size
+        final = offset >= len(view)
+        # The header is bound to the first segment so its fields can't be altered
+        associated_data = header if counter == 0 else None
+        yield aesgcm.encrypt(_nonce(prefix, counter, final), bytes(segment), associated_data)
+        if final:
+            return
+        counter += 1
+
+
+def decrypt_segments(key, chunks):
+    """
+    Decrypts the output of encrypt_segments, read in chunks of any size.
+
+    Args:
+        key (bytes): 32-byte AES key.
+        chunks (iterable): The encrypted bytes, in order.
+
+    Yields:
+        bytes: Each decrypted segment, once its tag has been checked.
+
+    Raises:
+        ValueError: If the data is not in this format, or was altered or truncated.
+    """
+    aesgcm = AESGCM(key)
+    buffer = bytearray()
+    header = None
+    counter = 0
+
+    for chunk in chunks:
+        buffer += chunk
+        if header is None:
+            if len(buffer) < HEADER_BYTES:
+                continue
+            header = bytes(buffer[:HEADER_BYTES])
+            magic, version, segment_size, prefix = _HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a segmented ciphertext")
+            del buffer[:HEADER_BYTES]
+            sealed_size = segment_size + TAG_BYTES
+
+        # Hold back one full segment: the last one can only be told apart once the input ends
+        while len(buffer) > sealed_size:
+            yield _open(aesgcm, prefix, counter, False, bytes(buffer[:sealed_size]), header)
+            del buffer[:sealed_size]
+            counter += 1
+
+    if header is None:
+        raise ValueError("Not a segmented ciphertext")
+    yield _open(aesgcm, prefix, counter, True, bytes(buffer), header)
+
+
+def _open(aesgcm, prefix, counter, final, sealed, header):
+    try:
+        return aesgcm.decrypt(_nonce(prefix, counter, final), sealed, header if counter == 0 else None)
+    except InvalidTag:
+        raise ValueError("Ciphertext was altered or truncated")
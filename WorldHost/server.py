@@ -1,18 +1,34 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Query, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 from typing import Optional
-from cryptography.fernet import Fernet
 import base64
 import json
 import os
-from httpx import AsyncClient, TimeoutException
-from parse_public import eth_address_to_pub_key
+from http_clients import HttpClientRegistry, parse_host_timeouts
+from parse_public import async_eth_address_to_pub_key, aclose_async_clients, use_http_client_registry, etherscan_api_url, PublicKeyCache, TablePublicKeyStore
+from pagination import encode_continuation_token, decode_continuation_token, read_page
+from feed_index import feed_entity, to_image_entity
+from sas import BulkSasSigner, SasCache
+from id_allocator import create_allocator
+from mint_worker import MintQueue, MintWorker, job_status, FAILED as MINT_FAILED
+from gallery_cache import create_gallery_cache
+from credentials import CredentialService, issue_session_token, verify_session_token
+from user_directory import UserDirectory
+from email_index import EMAIL_INDEX_PARTITION, email_index_entity, email_index_row_key
+from idempotency import IdempotencyStore, request_fingerprint, COMPLETED, IN_PROGRESS, MISMATCH
+from content_index import content_hash, lookup_blob, record_blob, lookup_nft, record_nft, record_nft_mint
+from crypto_executor import MeteredExecutor
+from segmented_cipher import generate_key, generate_nonce_prefix, encrypt_segments, ENCRYPTION_SCHEME
+from ipfs_car import CarFile, CarDirectory, cid_to_str
+from image_processing import generate_thumbnails, ingest_image, sniff_content_type, THUMBNAIL_SIZES, THUMBNAIL_FORMATS, EXTENSIONS_BY_CONTENT_TYPE, SNIFF_BYTES
+from table_queries import query_user_images, query_feed_page, get_user, user_exists, USER_PROFILE_FIELDS, LOGIN_FIELDS
 from ecies import encrypt, decrypt
 from io import BytesIO
-from azure.storage.blob import BlobServiceClient, ContainerClient, generate_blob_sas, BlobSasPermissions
+from azure.storage.blob import BlobServiceClient, ContainerClient, BlobBlock, ContentSettings
 from azure.data.tables import TableServiceClient, TableEntity
-import threading
+from azure.core.exceptions import ResourceExistsError
 from typing import List
 from urllib.parse import urlparse
 import hashlib
@@ -20,17 +36,52 @@ from dotenv import load_dotenv
 import datetime
 import time
 import asyncio
-from starlette.concurrency import run_in_threadpool
+import functools
+import anyio
 import pytz
-
-lock = threading.Lock()
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
 
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Every worker may run one, but only the holder of the leader lease in the mintjobs table mints;
+    # set MINT_WORKER_ENABLED=false to keep a process out of the election entirely
+    mint_task = None
+    if os.environ.get("MINT_WORKER_ENABLED", "true").lower() in ["true", "1", "yes"]:
+        mint_task = asyncio.create_task(mint_worker.run())
+    # Load every username in the background; lookups fall back to the table until it finishes
+    warm_task = asyncio.create_task(warm_user_directory())
+    # Outbound HTTP goes through pooled clients that live as long as the app
+    http_clients.open(NFT_STORAGE_API_URL, etherscan_api_url("SEP"))
+    use_http_client_registry(http_clients)
+    yield
+    warm_task.cancel()
+    if mint_task is not None:
+        mint_task.cancel()
+    credential_service.shutdown()
+    image_executor.shutdown(wait=False)
+    crypto_executor.shutdown(wait=False)
+    # Close what parse_public opened itself (web3 sessions, sync client), then the outbound pools
+    await aclose_async_clients()
+    await http_clients.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Set your NFT.storage API key in environment variable
 nft_storage_api_key = os.environ.get('NFT_STORAGE_API_KEY')
+# Point at nft_storage_stub.py to run uploads without the real service
+NFT_STORAGE_API_URL = os.environ.get('NFT_STORAGE_API_URL', 'https://api.nft.storage').rstrip('/')
+
+# One pooled HTTP/2 client per outbound host. Timeouts can be set per host as
+# HTTP_HOST_TIMEOUTS="host=seconds,..."; CAR uploads to NFT.storage keep a long one unless it's overridden
+http_clients = HttpClientRegistry(
+    default_timeout=float(os.environ.get("HTTP_TIMEOUT_SECONDS", "10")),
+    host_timeouts={urlparse(NFT_STORAGE_API_URL).hostname.lower(): 120.0, **parse_host_timeouts(os.environ.get("HTTP_HOST_TIMEOUTS"))},
+    max_connections=int(os.environ.get("HTTP_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+)
 # Set Etherscan API Key
 etherscan_api_key = os.environ.get('ETHERSCAN_API_KEY')
 # Set Web3 Provider
@@ -42,6 +93,24 @@ blob_storage_name = "dex-storage"
 account_key = os.environ.get("BLOB_ACCOUNT_KEY")
 connection_string = f"DefaultEndpointsProtocol=https;AccountName={account_name};AccountKey={account_key};EndpointSuffix=core.windows.net"
 
+# Signed read links are reused until they get within SAS_CACHE_MIN_REMAINING_SECONDS of expiry
+sas_cache = SasCache(
+    max_entries=int(os.environ.get("SAS_CACHE_MAX_ENTRIES", "10000")),
+    min_remaining=datetime.timedelta(seconds=int(os.environ.get("SAS_CACHE_MIN_REMAINING_SECONDS", "3600")))
+)
+
+# Per-user gallery entries, invalidated whenever create_table_entry writes a row for the user.
+# Set GALLERY_CACHE_URL to a Redis URL to share the cache between workers.
+# Every link we hand out has at least SAS_CACHE_MIN_REMAINING_SECONDS left, so a client's copy is
+# still good for a while if its gallery ETag changes every half of that
+ETAG_WINDOW_SECONDS = sas_cache.min_remaining.total_seconds() / 2
+
+gallery_cache = create_gallery_cache(
+    os.environ.get("GALLERY_CACHE_URL"),
+    max_users=int(os.environ.get("GALLERY_CACHE_MAX_USERS", "1000")),
+    ttl=int(os.environ.get("GALLERY_CACHE_TTL_SECONDS", "300"))
+)
+
 # Initialize Azure Blob Service Client
 blob_service_client = BlobServiceClient.from_connection_string(connection_string)
 
@@ -49,6 +118,88 @@ blob_service_client = BlobServiceClient.from_connection_string(connection_string
 table_service_client = TableServiceClient.from_connection_string(connection_string)
 table_client = table_service_client.get_table_client(table_name="dextablestorage")
 users_table_client = table_service_client.get_table_client(table_name="users")
+# Reverse-chronological copy of every image row, used by the community feed
+feed_table_client = table_service_client.create_table_if_not_exists(table_name="dexfeed")
+counters_table_client = table_service_client.create_table_if_not_exists(table_name="counters")
+public_keys_table_client = table_service_client.create_table_if_not_exists(table_name="pubkeys")
+mint_jobs_table_client = table_service_client.create_table_if_not_exists(table_name="mintjobs")
+# Content hash -> stored blob, so identical uploads reuse the first copy
+content_index_table_client = table_service_client.create_table_if_not_exists(table_name="contenthashes")
+# Stored /upload responses, keyed by the client's Idempotency-Key header
+idempotency_store = IdempotencyStore(
+    table_service_client.create_table_if_not_exists(table_name="idempotency"),
+    lease=int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "300")),
+    ttl=int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+)
+
+# Recovered public keys never change, so repeat uploaders skip Etherscan, the RPC and the recovery
+public_key_cache = PublicKeyCache(TablePublicKeyStore(public_keys_table_client))
+
+# Image IDs come from a block leased off a shared counter row, so they are unique across workers
+image_id_allocator = create_allocator(
+    os.environ.get("IMAGE_ID_ALLOCATOR", "table"),
+    table_client=counters_table_client,
+    block_size=int(os.environ.get("IMAGE_ID_BLOCK_SIZE", "100"))
+)
+
+# The Azure SDK clients are synchronous, so every call goes through this bounded pool
+# instead of blocking the event loop
+storage_limiter = anyio.CapacityLimiter(int(os.environ.get("STORAGE_MAX_THREADS", "32")))
+
+async def run_storage(func, *args, **kwargs):
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=storage_limiter)
+
+# Image decoding and resizing are CPU-bound, so they run in a separate process pool
+image_executor = ProcessPoolExecutor(max_workers=int(os.environ.get("IMAGE_MAX_WORKERS", "2")))
+THUMBNAIL_FORMAT = os.environ.get("THUMBNAIL_FORMAT", "WEBP").upper()
+
+# Uploads are capped, then downsampled and re-encoded before they are stored
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+INGEST_FORMAT = os.environ.get("INGEST_FORMAT", "WEBP").upper()
+INGEST_MAX_DIMENSION = int(os.environ.get("INGEST_MAX_DIMENSION", "2048"))
+INGEST_QUALITY = int(os.environ.get("INGEST_QUALITY", "85"))
+BLOB_CACHE_CONTROL = os.environ.get("BLOB_CACHE_CONTROL", "private, max-age=86400")
+ingest_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "deduplicated": 0}
+
+async def run_image_task(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(image_executor, func, *args)
+
+# Public key recovery, ECIES/AES encryption and mint signing share a metered pool, reported on /metrics
+crypto_executor = MeteredExecutor(max_workers=int(os.environ.get("CRYPTO_MAX_WORKERS", "4")))
+
+async def run_crypto_task(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(crypto_executor, func, *args)
+
+# Password hashing runs in its own process pool. Session tokens are signed with SESSION_SECRET,
+# which must be the same on every worker; without it each process signs with a random key.
+credential_service = CredentialService(max_workers=int(os.environ.get("KDF_MAX_WORKERS", "2")))
+session_secret = (os.environ.get("SESSION_SECRET") or os.urandom(32).hex()).encode()
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", "3600"))
+
+# Known usernames, so the upload path can validate users without a table round trip
+user_directory = UserDirectory(
+    negative_ttl=int(os.environ.get("USER_DIRECTORY_NEGATIVE_TTL_SECONDS", "30")),
+    max_missing=int(os.environ.get("USER_DIRECTORY_MAX_MISSING", "10000"))
+)
+
+def list_usernames():
+    filter_query = "RowKey eq 'userinfo'"
+    return [entity['PartitionKey'] for entity in users_table_client.query_entities(filter_query, select=['PartitionKey'], results_per_page=1000)]
+
+async def warm_user_directory():
+    try:
+        user_directory.warm(await run_storage(list_usernames))
+    except Exception:
+        # Not fatal: is_valid_username still asks the table for names it doesn't know
+        pass
+
+def session_claims(authorization):
+    # Returns the claims of a valid 'Bearer <token>' header, or None
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    return verify_session_token(session_secret, authorization[len("Bearer "):])
 
 # Ethereum node connection
 WEB3_PROVIDER_URI = os.getenv("WEB3_PROVIDER")
@@ -70,18 +221,32 @@ contract = web3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
 WALLET_PRIVATE_KEY = os.getenv("WALLET_PRIVATE_KEY")
 WALLET_ADDRESS = os.getenv("WALLET_ADDRESS")
 
+# Mints are queued and sent in the background so uploads don't wait on the chain
+mint_queue = MintQueue(mint_jobs_table_client)
+mint_worker = MintWorker(
+    mint_queue, web3, contract, WALLET_ADDRESS, WALLET_PRIVATE_KEY,
+    chain_id=11155111,
+    batch_size=int(os.environ.get("MINT_BATCH_SIZE", "10")),
+    poll_interval=float(os.environ.get("MINT_POLL_INTERVAL", "2")),
+    signing_executor=crypto_executor
+)
+# Mints an upload couldn't queue, retried in the background; held here so they aren't collected
+pending_mint_tasks = set()
+
 @app.get("/userData")
-async def user_data(username: str):
+async def user_data(username: str, authorization: Optional[str] = Header(None)):
+    # A session token from /login already carries these fields
+    claims = session_claims(authorization)
+    if claims and claims.get("sub") == username:
+        return {"email": claims.get("email"), "ethereum_address": claims.get("ethereum_address")}
+
     # try:
         # Query for the specific user
-    filter_query = f"PartitionKey eq '{username}' and RowKey eq 'userinfo'"
-    user_entities = list(users_table_client.query_entities(filter_query))
+    user_entity = await run_storage(get_user, users_table_client, username, USER_PROFILE_FIELDS)
 
-    if not user_entities:
+    if user_entity is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_entity = user_entities[0]
-
     # Assuming 'Email' and 'EthereumAddress' are the field names in your table
     email = user_entity.get('Email', 'No email provided')
     ethereum_address = user_entity.get('EthereumAddress', 'No Ethereum address provided')
@@ -94,19 +259,17 @@ async def user_data(username: str):
 async def register_user(username: str, password: str, email: str, ethereum_address: str = None):
     try:
         # Check if username already exists
-        username_query = f"PartitionKey eq '{username}'"
-        existing_users_by_username = list(users_table_client.query_entities(username_query))
-        if existing_users_by_username:
+        if await run_storage(user_exists, users_table_client, username):
             raise HTTPException(status_code=400, detail="Username already exists")
 
-        # Check if email already exists
-        email_query = f"Email eq '{email}'"
-        existing_users_by_email = list(users_table_client.query_entities(email_query))
-        if existing_users_by_email:
-            raise HTTPException(status_code=400, detail="Email already exists")
-
         # Hash the password
-        hashed_password = hash_password(password)
+        hashed_password = await credential_service.hash(password)
+
+        # Claim the email first: inserting its index row is an atomic uniqueness check
+        try:
+            await run_storage(users_table_client.create_entity, email_index_entity(email, username))
+        except ResourceExistsError:
+            raise HTTPException(status_code=400, detail="Email already exists")
 
         # Create user entity
         user_entity = TableEntity()
@@ -116,125 +279,170 @@ async def register_user(username: str, password: str, email: str, ethereum_addre
         user_entity['Email'] = email
         user_entity['EthereumAddress'] = ethereum_address
 
-        # Add to table
-        users_table_client.create_entity(user_entity)
+        # Add to table, releasing the email again if the username was taken in the meantime
+        try:
+            await run_storage(users_table_client.create_entity, user_entity)
+        except Exception as e:
+            await run_storage(users_table_client.delete_entity, partition_key=EMAIL_INDEX_PARTITION, row_key=email_index_row_key(email))
+            if isinstance(e, ResourceExistsError):
+                raise HTTPException(status_code=400, detail="Username already exists")
+            raise
+        user_directory.add(username)
 
         return {"message": "User registered successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
       
 @app.post("/login")
 async def login(username: str = Form(...), password: str = Form(...)):
-    filter_query = f"PartitionKey eq '{username}' and RowKey eq 'userinfo'"
-    user_entities = list(users_table_client.query_entities(filter_query))
+    user_entity = await run_storage(get_user, users_table_client, username, LOGIN_FIELDS)
 
-    if not user_entities:
+    if user_entity is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
                             detail="Invalid username or password")
 
-    user_entity = user_entities[0]
-    hashed_password = hash_password(password)
-
-    if user_entity['Password'] == hashed_password:
-        return {"status": "success", "message": "Login successful"}
+    password_matches, needs_rehash = await credential_service.verify(password, user_entity['Password'])
+
+    if password_matches:
+        if needs_rehash:
+            # Upgrade legacy SHA-256 rows now that we have the plaintext
+            await run_storage(users_table_client.update_entity, {
+                'PartitionKey': username,
+                'RowKey': 'userinfo',
+                'Password': await credential_service.hash(password)
+            })
+
+        session_token = issue_session_token(session_secret, {
+            "sub": username,
+            "email": user_entity.get('Email', 'No email provided'),
+            "ethereum_address": user_entity.get('EthereumAddress', 'No Ethereum address provided')
+        }, SESSION_TTL_SECONDS)
+        return {"status": "success", "message": "Login successful", "session_token": session_token, "expires_in": SESSION_TTL_SECONDS}
     else:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
                             detail="Invalid username or password")
       
 @app.get("/getAllUsernames")
-async def get_all_usernames():
+async def get_all_usernames(page_size: int = Query(1000, ge=1, le=1000), continuation_token: Optional[str] = None, format: str = "json"):
+    # Assuming 'userinfo' is the RowKey for all user entries; only the PartitionKey is fetched
+    filter_query = "RowKey eq 'userinfo'"
+
+    if format == "ndjson":
+        # One JSON string per line, streamed a table page at a time
+        return StreamingResponse(iter_username_lines(filter_query, page_size), media_type="application/x-ndjson")
+
+    try:
+        token = decode_continuation_token(continuation_token)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        # Query to retrieve all user entities
-        filter_query = "RowKey eq 'userinfo'"  # Assuming 'userinfo' is the RowKey for all user entries
-        user_entities = users_table_client.query_entities(filter_query)
+        user_entities, next_token = await run_storage(
+            read_page,
+            lambda n: users_table_client.query_entities(filter_query, results_per_page=n, select=['PartitionKey']),
+            page_size,
+            token
+        )
 
         # Extracting usernames (PartitionKey)
         usernames = [entity['PartitionKey'] for entity in user_entities]
 
-        return {"usernames": usernames}
+        return {"usernames": usernames, "continuation_token": encode_continuation_token(next_token)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/getUserImageUrls")
-async def get_user_image_urls(user_id: str):
-    # try:
-        filter_query = f"PartitionKey eq '{user_id}'"
-        queried_entities = table_client.query_entities(filter_query)
+def iter_username_lines(filter_query, page_size):
+    # A sync generator, so StreamingResponse runs it in a worker thread
+    pages = users_table_client.query_entities(filter_query, results_per_page=page_size, select=['PartitionKey']).by_page()
+    for page in pages:
+        yield "".join(json.dumps(entity['PartitionKey']) + "\n" for entity in page)
 
-        processed_entries = convert_queries_to_entries(queried_entities)
+@app.get("/metrics")
+async def metrics():
+    return {"sas_cache": sas_cache.stats(), "crypto_executor": crypto_executor.stats(), "ingest": dict(ingest_stats, bytes_saved=ingest_stats["bytes_in"] - ingest_stats["bytes_out"])}
 
-        return {"images": processed_entries}
+@app.get("/getUserImageUrls")
+async def get_user_image_urls(user_id: str, if_none_match: Optional[str] = Header(None)):
+    # try:
+        image_infos = await run_storage(gallery_cache.get, user_id)
+        if image_infos is None:
+            # Read before the query, so an upload landing in between keeps this result out of the cache
+            generation = await run_storage(gallery_cache.generation, user_id)
+            queried_entities = await run_storage(query_user_images, table_client, user_id)
+            image_infos = list(iter_image_infos(queried_entities))
+            await run_storage(gallery_cache.set, user_id, image_infos, generation)
+
+        # The tag covers the unsigned entries and the current link window rather than the signed
+        # URLs, so every worker gives the same gallery the same tag whatever its SAS cache holds
+        window = int(time.time() // ETAG_WINDOW_SECONDS)
+        etag = '"' + hashlib.sha256(json.dumps({"images": image_infos, "window": window}, sort_keys=True).encode()).hexdigest() + '"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        payload = {"images": sign_image_infos(image_infos)}
+        return JSONResponse(payload, headers={"ETag": etag})
 
     # except Exception as e:
     #     raise HTTPException(status_code=500, detail="Internal Server Error")
       
 @app.get("/excludeUserImageUrls")
-async def exclude_user_images_urls(user_id: str, page: int = 1, items_per_page: int = 3):
+async def exclude_user_images_urls(user_id: str, page: int = Query(1, ge=1), items_per_page: int = Query(3, ge=1, le=1000), continuation_token: Optional[str] = None):
   try:
-      start_index = (page - 1) * items_per_page
-      end_index = start_index + items_per_page
-      filter_query = f"PartitionKey ne '{user_id}'"
-      queried_entities = table_client.query_entities(filter_query)
-      
-      processed_entries = convert_queries_to_entries(queried_entities)
-      sorted_entries = sorted(processed_entries, key=lambda x: x['date_added'], reverse=True)
+      token = decode_continuation_token(continuation_token)
+  except ValueError as e:
+      raise HTTPException(status_code=400, detail=str(e))
+  try:
+      # Clients that still page by number skip ahead over the index without converting rows
+      if token is None and page > 1:
+          _, token = await run_storage(query_feed_page, feed_table_client, user_id, (page - 1) * items_per_page, select=['RowKey'])
+          if token is None:
+              return {"images": [], "continuation_token": None}
 
-      paginated_entries = sorted_entries[start_index:end_index]
-      
-      return {"images": paginated_entries}
+      feed_entities, next_token = await run_storage(query_feed_page, feed_table_client, user_id, items_per_page, token)
+
+      processed_entries = convert_queries_to_entries(to_image_entity(entity) for entity in feed_entities)
+
+      return {"images": processed_entries, "continuation_token": encode_continuation_token(next_token)}
   except Exception as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
       
-def create_service_sas_blob(blob_url: str, account_key: str):
-    # Parse the URL to get blob container and name
-    parsed_url = urlparse(blob_url)
-    blob_path = parsed_url.path.lstrip('/')  # Remove leading '/'
-    container_name, blob_name = blob_path.split('/', 1)
-
-    # Create a SAS token valid for one day
-    start_time = datetime.datetime.now(datetime.timezone.utc)
-    expiry_time = start_time + datetime.timedelta(days=1)
-
-    sas_token = generate_blob_sas(
-        account_name=account_name,
-        container_name=container_name,
-        blob_name=blob_name,
-        account_key=account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=expiry_time,
-        start=start_time
-    )
+def entity_to_image_info(entity):
+    # Blob URLs are left unsigned here; sign_image_infos signs only what is returned
+    return {
+        "image_id": entity['RowKey'],
+        "user_id": entity['PartitionKey'],
+        "ipfs_cid": entity.get('IPFSCid', ''),
+        "date_added": entity.get('DateAdded', ''),
+        "location_taken": entity.get('LocationTaken', ''),
+        "details": entity.get('Details', ''),
+        "probability": entity.get('Probability', ''),
+        "image_classification": entity.get('ImageClassification', ''),
+        "cropped_image_url": entity.get('CroppedImageBlobURL', ''),
+        "image_url": entity.get('ImageBlobURL', ''),
+        "thumbnails": json.loads(entity.get('ThumbnailURLs') or '{}')
+    }
 
-    return f"{blob_url}?{sas_token}"
+def iter_image_infos(queries):
+    for entity in queries:
+        yield entity_to_image_info(entity)
 
-def convert_queries_to_entries(queries):
+def sign_image_infos(image_infos, signer=None):
+    # One signer per request so every link shares the same start/expiry window
+    signer = signer or BulkSasSigner(account_name, account_key, cache=sas_cache)
     result = []
-    for entity in queries:
-        cropped_image_blob_url = entity.get('CroppedImageBlobURL', '')
-        image_blob_url = entity.get('ImageBlobURL', '')
-
-        # Generate SAS URLs
-        if cropped_image_blob_url:
-            cropped_image_blob_url = create_service_sas_blob(cropped_image_blob_url, account_key)
-        if image_blob_url:
-            image_blob_url = create_service_sas_blob(image_blob_url, account_key)
-
-        image_info = {
-            "image_id": entity['RowKey'],
-            "user_id": entity['PartitionKey'],
-            "ipfs_cid": entity.get('IPFSCid', ''),
-            "date_added": entity.get('DateAdded', ''),
-            "location_taken": entity.get('LocationTaken', ''),
-            "details": entity.get('Details', ''),
-            "probability": entity.get('Probability', ''),
-            "image_classification": entity.get('ImageClassification', ''),
-            "cropped_image_url": cropped_image_blob_url,
-            "image_url": image_blob_url
-        }
+    for image_info in image_infos:
+        image_info["cropped_image_url"] = signer.sign(image_info["cropped_image_url"])
+        image_info["image_url"] = signer.sign(image_info["image_url"])
+        # A new dict, so thumbnail URLs shared with the gallery cache are never signed in place
+        image_info["thumbnails"] = {size: signer.sign(url) for size, url in image_info.get("thumbnails", {}).items()}
         result.append(image_info)
     return result
 
+def convert_queries_to_entries(queries):
+    return sign_image_infos(iter_image_infos(queries))
+
 @app.post("/upload")
 async def upload(
     image_base64: str = Form(...), 
@@ -245,79 +453,202 @@ async def upload(
     location_taken: str = Form(...), 
     details: str = Form(...), 
     probability: str = Form(...),
-    image_classification: str = Form(...)
+    image_classification: str = Form(...),
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     start_time = time.time()  # Start timing
 
-    if not await is_valid_username(user_id):
+    if not await is_authorized_user(user_id, authorization):
       raise HTTPException(status_code=400, detail="Invalid user ID")
     
     # print(f"User validation completed in {time.time() - start_time} seconds")
-    
+
     decentralize_storage_bool = decentralize_storage.lower() in ["true", "1", "yes"]
-        
-    # Convert base64 images back to bytes for decentralized upload
-    cropped_image_content = base64.b64decode(cropped_image_base64)
-    image_content = base64.b64decode(image_base64)
-    decentralized_upload_successful = False
-    metadata_cid = None
-    metadata_url = ""
-    
     if decentralize_storage_bool:
-      segment_start = time.time()
-      # print(f'eth address: {eth_address}\n')
-      public_key, _ = eth_address_to_pub_key(eth_address, etherscan_api_key, "SEP", web3provider)
-      public_key_hex = public_key.to_hex()
-      encrypted_key, encrypted_image = encrypt_image(cropped_image_content, public_key_hex)
-      # print(f"Encryption and key retrieval completed in {time.time() - segment_start} seconds")
-
-      segment_start = time.time()
-      # NFT Storage Upload
-      async with AsyncClient() as client:
-        image_cid = await upload_to_nft_storage(client, encrypted_image, image_classification)
-        # print(f"NFT storage upload completed in {time.time() - segment_start} seconds")
-
-        segment_start = time.time()
-        # Prepare metadata
-        metadata = {
-            "name": "Encrypted Image",
-            "description": "An encrypted image with its encrypted symmetric key",
-            "image": f"ipfs://{image_cid}",
-            "properties": {"encrypted_key": encrypted_key}
-        }
-
-        metadata_cid = await upload_metadata_to_nft_storage(client, metadata, image_cid)
-        metadata_url = f"https://{metadata_cid}.ipfs.nftstorage.link"
-        # print(f"Metadata upload completed in {time.time() - segment_start} seconds")
-
-        decentralized_upload_successful = True
-        if decentralized_upload_successful:
-            segment_start = time.time()
-            mint_response = await mint_nft(metadata_cid, eth_address)
-            # print(f"NFT minting completed in {time.time() - segment_start} seconds")
+      eth_address = checksum_eth_address(eth_address)
+
+    # A retry with the same key gets the first response back without redoing the upload
+    if idempotency_key:
+      fingerprint = request_fingerprint(image_base64, cropped_image_base64, decentralize_storage, eth_address, location_taken, details, probability, image_classification)
+      outcome, stored_response = await run_storage(idempotency_store.claim, user_id, idempotency_key, fingerprint)
+      if outcome == COMPLETED:
+        return stored_response
+      if outcome == IN_PROGRESS:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+      if outcome == MISMATCH:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
 
+    try:
+      # Convert base64 images back to bytes, then shrink them before anything is stored
+      image_content, cropped_image_content = await asyncio.gather(
+          ingest_upload(base64.b64decode(image_base64)),
+          ingest_upload(base64.b64decode(cropped_image_base64))
+      )
+      response = await store_upload(
+          start_time=start_time,
+          image=image_content,
+          cropped_image=cropped_image_content,
+          decentralize_storage_bool=decentralize_storage_bool,
+          eth_address=eth_address,
+          user_id=user_id,
+          location_taken=location_taken,
+          details=details,
+          probability=probability,
+          image_classification=image_classification
+      )
+    except Exception:
+      if idempotency_key:
+        await run_storage(idempotency_store.release, user_id, idempotency_key)
+      raise
+
+    if idempotency_key:
+      try:
+        await run_storage(idempotency_store.complete, user_id, idempotency_key, response)
+      except Exception:
+        # The upload itself succeeded; the claim lapses after the lease and a retry redoes it
+        pass
+    return response
+
+@app.post("/v2/upload")
+async def upload_v2(
+    image: UploadFile = File(...),
+    cropped_image: UploadFile = File(...),
+    decentralize_storage: Optional[str] = Form("false"),
+    eth_address: Optional[str] = Form(None),
+    user_id: str = Form(...),
+    location_taken: str = Form(...),
+    details: str = Form(...),
+    probability: str = Form(...),
+    image_classification: str = Form(...),
+    authorization: Optional[str] = Header(None)
+):
+    # Same as /upload, but the images arrive as raw multipart parts and are streamed
+    # into block blobs chunk by chunk instead of being decoded from base64 in memory
+    start_time = time.time()
 
-    # Centralized upload logic
-    segment_start = time.time()
-    image_id = get_next_image_id()  # Get a unique image identifier
-    # print(f"Image ID generation completed in {time.time() - segment_start} seconds")
+    if not await is_authorized_user(user_id, authorization):
+      raise HTTPException(status_code=400, detail="Invalid user ID")
 
-    segment_start = time.time()
-    # Call to centralized upload function
-    centralized_upload_response = await centralized_upload(
-        image=image_content,
+    decentralize_storage_bool = decentralize_storage.lower() in ["true", "1", "yes"]
+    if decentralize_storage_bool:
+      eth_address = checksum_eth_address(eth_address)
+
+    # The crop is small next to the full image and is needed whole for thumbnails and
+    # encryption, so only the full image is streamed. Streaming means the full image is
+    # stored as sent rather than re-encoded, so only its type and size are checked; the type
+    # is taken from the file's own header, which must agree with the declared one
+    extension = EXTENSIONS_BY_CONTENT_TYPE.get(image.content_type)
+    if extension is None:
+      raise HTTPException(status_code=415, detail=f"Unsupported image type: {image.content_type}")
+    sniffed_type = sniff_content_type(await image.read(SNIFF_BYTES))
+    if sniffed_type != image.content_type:
+      raise HTTPException(status_code=415, detail=f"Image content does not match its declared type {image.content_type}")
+    await image.seek(0)
+    cropped_image_content = await ingest_upload(await cropped_image.read(MAX_UPLOAD_BYTES + 1))
+
+    return await store_upload(
+        start_time=start_time,
+        image={"data": image, "content_type": image.content_type, "extension": extension},
         cropped_image=cropped_image_content,
+        decentralize_storage_bool=decentralize_storage_bool,
+        eth_address=eth_address,
         user_id=user_id,
-        image_id=image_id,
         location_taken=location_taken,
-        user_address=eth_address,
         details=details,
         probability=probability,
-        image_classification=image_classification,
-        ipfs_cid=metadata_cid or "N/A"
+        image_classification=image_classification
     )
+
+def checksum_eth_address(eth_address):
+    # is_address accepts any case, but the mint transaction's ABI encoder only takes the checksummed form
+    if not eth_address or not Web3.is_address(eth_address):
+      raise HTTPException(status_code=400, detail="Invalid Ethereum address")
+    return Web3.to_checksum_address(eth_address)
+
+async def ingest_upload(image_bytes):
+    # Reject oversized uploads before decoding them. The content index is keyed on the bytes as
+    # uploaded; a hit means these exact bytes were validated and stored before, so the transcode
+    # is skipped and data stays the raw upload (see ingested_data). Otherwise downsample and
+    # re-encode in the image pool
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+      raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_UPLOAD_BYTES} bytes")
+    digest = content_hash(image_bytes)
+    existing = await run_storage(lookup_blob, content_index_table_client, digest)
+    if existing is not None:
+      ingest_stats["deduplicated"] += 1
+      return {"data": image_bytes, "content_type": existing["content_type"], "extension": existing["extension"], "sha256": digest, "existing": existing, "ingested": False}
+
+    try:
+      data, content_type, extension = await run_image_task(ingest_image, image_bytes, INGEST_MAX_DIMENSION, INGEST_FORMAT, INGEST_QUALITY)
+    except ValueError as e:
+      raise HTTPException(status_code=400, detail=str(e))
+    ingest_stats["images"] += 1
+    ingest_stats["bytes_in"] += len(image_bytes)
+    ingest_stats["bytes_out"] += len(data)
+    return {"data": data, "content_type": content_type, "extension": extension, "sha256": digest, "existing": None}
+
+async def ingested_data(source):
+    # The transcoded bytes, for the rare index hit that still needs them (an NFT not yet uploaded)
+    if source.get("ingested", True):
+      return source["data"]
+    data, _, _ = await run_image_task(ingest_image, source["data"], INGEST_MAX_DIMENSION, INGEST_FORMAT, INGEST_QUALITY)
+    return data
+
+async def store_upload(start_time, image, cropped_image, decentralize_storage_bool, eth_address, user_id, location_taken, details, probability, image_classification):
+    # Both images are {"data", "content_type", "extension"}; image's data is either bytes or an
+    # UploadFile part to stream from, cropped_image's is always bytes
+    decentralized_upload_successful = False
+    metadata_cid = None
+    metadata_url = ""
+    mint_job_id = None
+
+    # Centralized upload logic
+    segment_start = time.time()
+    image_id = await run_storage(get_next_image_id)  # Get a unique image identifier
+    # print(f"Image ID generation completed in {time.time() - segment_start} seconds")
+
+    # The blob writes and the NFT.storage leg don't depend on each other, so run them together
+    legs = [upload_image_blobs(image_id, image, cropped_image)]
+    if decentralize_storage_bool:
+      legs.append(deduplicated_decentralized_upload(cropped_image, eth_address, image_classification))
+    results = await asyncio.gather(*legs, return_exceptions=True)
+
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+      if not isinstance(results[0], BaseException):
+        await delete_blobs(stored_blob_urls(results[0]))
+      if isinstance(failures[0], HTTPException):
+        raise failures[0]
+      raise HTTPException(status_code=500, detail=str(failures[0]))
+
+    stored_blobs = results[0]
+    if decentralize_storage_bool:
+      metadata_cid, metadata_url, mint_job_id = results[1]
+      decentralized_upload_successful = True
+
+    # The table row is only written once every leg has succeeded
+    segment_start = time.time()
+    try:
+      await run_storage(create_table_entry, user_id, image_id, location_taken, eth_address, details, probability, stored_blobs["image"], stored_blobs["cropped_image"], metadata_cid or "N/A", image_classification, stored_blobs["thumbnails"])
+    except Exception as e:
+      await delete_blobs(stored_blob_urls(stored_blobs))
+      raise HTTPException(status_code=500, detail=str(e))
+    await index_stored_blobs(image, cropped_image, stored_blobs)
+    centralized_upload_response = {"status": "success", "message": "Image and metadata successfully uploaded to centralized storage."}
     # print(f"Centralized upload completed in {time.time() - segment_start} seconds")
 
+    if decentralized_upload_successful and mint_job_id is None:
+      # The mint worker picks this up; poll /mintStatus for the transaction. The table row exists
+      # now, so failing here would release the Idempotency-Key and a retry would write a second
+      # row; the mint is queued in the background instead and the response has no job ID
+      try:
+        mint_job_id = await queue_mint(metadata_cid, eth_address, cropped_image["sha256"])
+      except Exception:
+        task = asyncio.create_task(queue_mint_later(metadata_cid, eth_address, cropped_image["sha256"]))
+        pending_mint_tasks.add(task)
+        task.add_done_callback(pending_mint_tasks.discard)
+
     total_time = time.time() - start_time
     # print(f"Total upload process completed in {total_time} seconds")
     
@@ -326,97 +657,253 @@ async def upload(
         "centralized_upload": centralized_upload_response,
         "message": "Upload process completed.",
         "metadata_cid": metadata_cid,
-        "metadata_url": metadata_url
+        "metadata_url": metadata_url,
+        "mint_job_id": mint_job_id
     }
 
-    
-async def upload_to_nft_storage(client, encrypted_image, image_classification):
-    image_response = await client.post(
-        'https://api.nft.storage/upload',
-        files={'file': (image_classification, encrypted_image, 'application/octet-stream')},
-        headers={'Authorization': f'Bearer {nft_storage_api_key}'}
-    )
-    if image_response.status_code == 200:
-        image_cid = image_response.json().get('value', {}).get('cid')
-        return image_cid
-    else:
-        raise HTTPException(status_code=image_response.status_code, detail="Failed to upload to NFT Storage")
-
-async def upload_metadata_to_nft_storage(client, metadata, image_cid):
-    metadata_bytes = json.dumps(metadata).encode('utf-8')
-    metadata_file = BytesIO(metadata_bytes)
-    metadata_file.seek(0)
-    metadata_response = await client.post(
-        'https://api.nft.storage/upload',
-        files={'file': ('metadata.json', metadata_file, 'application/octet-stream')},
-        headers={'Authorization': f'Bearer {nft_storage_api_key}'}
+
+async def queue_mint(metadata_cid, eth_address, digest):
+    mint_job_id = await run_storage(mint_queue.enqueue, metadata_cid, eth_address)
+    try:
+      # Lets a later upload of the same image for this owner reuse the mint
+      await run_storage(record_nft_mint, content_index_table_client, digest, eth_address, mint_job_id)
+    except Exception:
+      pass
+    return mint_job_id
+
+async def queue_mint_later(metadata_cid, eth_address, digest, retries=5, backoff=5.0):
+    # Not durable across a restart, but the content index then has no job for the image, so the
+    # next upload of it for this owner queues the mint
+    for attempt in range(retries):
+      await asyncio.sleep(backoff * (2 ** attempt))
+      try:
+        await queue_mint(metadata_cid, eth_address, digest)
+        return
+      except Exception:
+        pass
+
+async def deduplicated_decentralized_upload(cropped_image, eth_address, image_classification):
+    # The same crop for the same owner is already pinned, so hand back the earlier metadata and,
+    # unless it failed, the mint already queued for it, so a retry doesn't mint a second token
+    cached = await run_storage(lookup_nft, content_index_table_client, cropped_image["sha256"], eth_address)
+    if cached is not None:
+      metadata_cid, metadata_url, mint_job_id = cached
+      if mint_job_id is not None:
+        job = await run_storage(mint_queue.get, mint_job_id)
+        if job is None or job["Status"] == MINT_FAILED:
+          mint_job_id = None
+      return metadata_cid, metadata_url, mint_job_id
+    metadata_cid, metadata_url = await decentralized_upload(await ingested_data(cropped_image), eth_address, image_classification)
+    try:
+      await run_storage(record_nft, content_index_table_client, cropped_image["sha256"], eth_address, metadata_cid, metadata_url)
+    except Exception:
+      pass
+    return metadata_cid, metadata_url, None
+
+async def decentralized_upload(cropped_image_content, eth_address, image_classification):
+    public_key, _ = await async_eth_address_to_pub_key(eth_address, etherscan_api_key, "SEP", web3provider, cache=public_key_cache, http_client=http_clients.for_url(etherscan_api_url("SEP")), executor=crypto_executor)
+    public_key_hex = public_key.to_hex()
+    # The image is encrypted under a fresh key wrapped for the owner. The nonce prefix is fixed up front
+    # because the ciphertext is produced twice: once to compute its CIDs, once while it is sent
+    symmetric_key = generate_key()
+    nonce_prefix = generate_nonce_prefix()
+    encrypted_key = base64.b64encode(await run_crypto_task(encrypt, public_key_hex, symmetric_key)).decode()
+
+    def pack():
+        image = CarFile("image", lambda: encrypt_segments(symmetric_key, cropped_image_content, nonce_prefix=nonce_prefix))
+        # The image CID is known locally, so the metadata can point at it before anything is uploaded
+        metadata = {
+            "name": "Encrypted Image",
+            "description": "An encrypted image with its encrypted symmetric key",
+            "image": f"ipfs://{cid_to_str(image.cid)}",
+            "properties": {"encrypted_key": encrypted_key, "encryption": ENCRYPTION_SCHEME}
+        }
+        metadata_bytes = json.dumps(metadata).encode('utf-8')
+        metadata_file = CarFile("metadata.json", lambda: [metadata_bytes])
+        return CarDirectory([image, metadata_file]), metadata_file.cid
+
+    car, metadata_cid = await run_crypto_task(pack)
+
+    # Image and metadata go up together in a single CAR upload
+    await upload_car_to_nft_storage(http_clients.for_url(NFT_STORAGE_API_URL), car)
+
+    metadata_cid = cid_to_str(metadata_cid)
+    metadata_url = f"https://{metadata_cid}.ipfs.nftstorage.link"
+    return metadata_cid, metadata_url
+
+async def upload_car_to_nft_storage(client, car):
+    # The CAR is streamed as it is encrypted, with its length known from the CID pass
+    car_chunks = iter(car)
+
+    async def body():
+        while True:
+            chunk = await run_crypto_task(next, car_chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    response = await client.post(
+        f'{NFT_STORAGE_API_URL}/upload',
+        content=body(),
+        headers={
+            'Authorization': f'Bearer {nft_storage_api_key}',
+            'Content-Type': 'application/car',
+            'Content-Length': str(len(car))
+        }
     )
-    if metadata_response.status_code == 200:
-        metadata_cid = metadata_response.json().get('value', {}).get('cid')
-        return metadata_cid
-    else:
-        raise HTTPException(status_code=metadata_response.status_code, detail="Failed to upload metadata to NFT Storage")
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Failed to upload to NFT Storage")
+    root_cid = response.json().get('value', {}).get('cid')
+    if root_cid != cid_to_str(car.root):
+        raise HTTPException(status_code=502, detail="NFT Storage returned an unexpected CID")
+    return root_cid
     
 
 # New endpoint for centralized storage upload
 @app.post("/centralized_upload/")
 async def centralized_upload(image: str = Form(...), cropped_image: str = Form(...), user_id: str = Form(...), image_id: str = Form(...), location_taken: str = Form(...), user_address: str = Form(...), details: str = Form(...), probability: str = Form(...), ipfs_cid: str = Form(...), image_classification: str = Form(...)):
     try:
+        # The images arrive base64 encoded, as they do on /upload
+        image_content, cropped_image_content = await asyncio.gather(
+            ingest_upload(base64.b64decode(image)),
+            ingest_upload(base64.b64decode(cropped_image))
+        )
+
         # Upload images to blob storage
-        image_blob_url = upload_image_to_blob(blob_storage_name, f"{image_id}.png", BytesIO(image))
-        cropped_image_blob_url = upload_image_to_blob(blob_storage_name, f"{image_id}_cropped.png", BytesIO(cropped_image))
+        stored_blobs = await upload_image_blobs(image_id, image_content, cropped_image_content)
 
         # Create a table entry
-        create_table_entry(user_id, image_id, location_taken, user_address, details, probability, image_blob_url, cropped_image_blob_url, ipfs_cid, image_classification)
+        try:
+            await run_storage(create_table_entry, user_id, image_id, location_taken, user_address, details, probability, stored_blobs["image"], stored_blobs["cropped_image"], ipfs_cid, image_classification, stored_blobs["thumbnails"])
+        except Exception:
+            await delete_blobs(stored_blob_urls(stored_blobs))
+            raise
+        await index_stored_blobs(image_content, cropped_image_content, stored_blobs)
 
         return {"status": "success", "message": "Image and metadata successfully uploaded to centralized storage."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
   
-# Updated encrypt_image function
-def encrypt_image(image_data_bytes, eth_public_key_hex):
-    symmetric_key = Fernet.generate_key()
-    cipher_suite = Fernet(symmetric_key)
-    encrypted_image = cipher_suite.encrypt(image_data_bytes)
-    encrypted_symmetric_key = encrypt(eth_public_key_hex, symmetric_key)
-    
-    return base64.b64encode(encrypted_symmetric_key).decode(), encrypted_image
-  
-async def upload_to_nft_storage(client, encrypted_image, image_classification):
-    image_response = await client.post(
-        'https://api.nft.storage/upload',
-        files={'file': (image_classification, encrypted_image, 'application/octet-stream')},
-        headers={'Authorization': f'Bearer {nft_storage_api_key}'}
-    )
-    if image_response.status_code == 200:
-        image_cid = image_response.json().get('value', {}).get('cid')
-        return image_cid
-    else:
-        raise HTTPException(status_code=image_response.status_code, detail="Failed to upload to NFT Storage")
 
 def get_next_image_id():
-    lock.acquire()
-    try:
-        # Read the current ID
-        with open("next_id.txt", "r") as file:
-            current_id = int(file.read().strip())
-
-        # Increment and save the next ID
-        with open("next_id.txt", "w") as file:
-            file.write(str(current_id + 1))
-
-        return str(current_id)
-    finally:
-        lock.release()
+    # Only touches storage when the current block of IDs runs out
+    return image_id_allocator.next_id()
     
 # Function to upload an image to blob storage
-def upload_image_to_blob(container_name, blob_name, image_data):
+def upload_image_to_blob(container_name, blob_name, image_data, content_settings=None):
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-    blob_client.upload_blob(image_data)
+    blob_client.upload_blob(image_data, content_settings=content_settings)
     return blob_client.url
 
+# Size of each block staged when streaming an UploadFile into a block blob
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+async def stream_upload_to_blob(container_name, blob_name, upload_file, content_settings=None):
+    # Stage the upload block by block so only one chunk per file is held in memory.
+    # Blocks that are never committed are discarded by the service
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+    block_list = []
+    total_bytes = 0
+    while True:
+        chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total_bytes += len(chunk)
+        if total_bytes > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_UPLOAD_BYTES} bytes")
+        block_id = base64.b64encode(f"{len(block_list):08d}".encode()).decode()
+        await run_storage(blob_client.stage_block, block_id, chunk)
+        block_list.append(BlobBlock(block_id=block_id))
+    await run_storage(blob_client.commit_block_list, block_list, content_settings=content_settings)
+    return blob_client.url
+
+async def upload_source_to_blob(container_name, blob_name, source):
+    content_settings = ContentSettings(content_type=source["content_type"], cache_control=BLOB_CACHE_CONTROL)
+    if isinstance(source["data"], bytes):
+        return await run_storage(upload_image_to_blob, container_name, blob_name, BytesIO(source["data"]), content_settings)
+    return await stream_upload_to_blob(container_name, blob_name, source["data"], content_settings)
+
+async def upload_thumbnails(image_id, cropped_image):
+    # Thumbnails are a nice-to-have: if the crop can't be decoded or a write fails, the
+    # upload still succeeds and the gallery falls back to the full-size links
+    extension, content_type = THUMBNAIL_FORMATS[THUMBNAIL_FORMAT]
+    try:
+        thumbnails = await run_image_task(generate_thumbnails, cropped_image["data"], THUMBNAIL_SIZES, THUMBNAIL_FORMAT)
+    except Exception:
+        return {}
+
+    content_settings = ContentSettings(content_type=content_type, cache_control=BLOB_CACHE_CONTROL)
+    sizes = list(thumbnails)
+    results = await asyncio.gather(
+        *(run_storage(upload_image_to_blob, blob_storage_name, f"{image_id}_thumb_{size}.{extension}", BytesIO(thumbnails[size]), content_settings) for size in sizes),
+        return_exceptions=True
+    )
+    uploaded = {str(size): url for size, url in zip(sizes, results) if not isinstance(url, BaseException)}
+    if len(uploaded) < len(sizes):
+        await delete_blobs(list(uploaded.values()))
+        return {}
+    return uploaded
+
+async def reuse_or_upload(blob_stem, source):
+    # Returns the blob URL and whether this request wrote it
+    existing = source.get("existing")
+    if existing:
+        return existing["url"], False
+    return await upload_source_to_blob(blob_storage_name, f"{blob_stem}.{source['extension']}", source), True
+
+async def reuse_or_upload_thumbnails(image_id, cropped_image):
+    existing = cropped_image.get("existing")
+    if existing and existing["thumbnails"]:
+        return existing["thumbnails"], False
+    return await upload_thumbnails(image_id, cropped_image), True
+
+async def upload_image_blobs(image_id, image, cropped_image):
+    # Upload both blobs and the thumbnails concurrently, reusing any already stored for the same content;
+    # if one fails, delete the new ones so nothing is left orphaned
+    results = await asyncio.gather(
+        reuse_or_upload(image_id, image),
+        reuse_or_upload(f"{image_id}_cropped", cropped_image),
+        reuse_or_upload_thumbnails(image_id, cropped_image),
+        return_exceptions=True
+    )
+    new_blobs = []
+    for result in results:
+        if isinstance(result, BaseException) or not result[1]:
+            continue
+        new_blobs.extend(result[0].values() if isinstance(result[0], dict) else [result[0]])
+
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        await delete_blobs(new_blobs)
+        raise failures[0]
+    return {"image": results[0][0], "cropped_image": results[1][0], "thumbnails": results[2][0], "new_blobs": new_blobs}
+
+def stored_blob_urls(stored_blobs):
+    # Only the blobs this upload wrote; reused ones still belong to earlier images
+    return stored_blobs["new_blobs"]
+
+async def index_stored_blobs(image, cropped_image, stored_blobs):
+    # Indexed only once the table row exists, so the index never points at blobs a failed upload deleted.
+    # Best effort: a missing entry only costs a duplicate blob later
+    writes = []
+    if image.get("sha256") and not image.get("existing"):
+        writes.append(run_storage(record_blob, content_index_table_client, image["sha256"], stored_blobs["image"], image["content_type"], image["extension"]))
+    if cropped_image.get("sha256") and not cropped_image.get("existing"):
+        writes.append(run_storage(record_blob, content_index_table_client, cropped_image["sha256"], stored_blobs["cropped_image"], cropped_image["content_type"], cropped_image["extension"], stored_blobs["thumbnails"]))
+    await asyncio.gather(*writes, return_exceptions=True)
+
+def delete_blob(blob_url):
+    container_name, blob_name = url_to_blob(blob_url)
+    blob_service_client.get_blob_client(container=container_name, blob=blob_name).delete_blob()
+
+async def delete_blobs(blob_urls):
+    # Compensating deletes are best effort; the original error is what gets reported
+    await asyncio.gather(*(run_storage(delete_blob, blob_url) for blob_url in blob_urls), return_exceptions=True)
+
 # Function to create a table entry
-def create_table_entry(user_id, image_id, location_taken, user_address, details, probability, image_blob_url, cropped_image_blob_url, ipfs_cid, image_classification):
+def create_table_entry(user_id, image_id, location_taken, user_address, details, probability, image_blob_url, cropped_image_blob_url, ipfs_cid, image_classification, thumbnail_urls=None):
     entity = TableEntity()
     entity['PartitionKey'] = user_id
     entity['RowKey'] = image_id
@@ -428,62 +915,60 @@ def create_table_entry(user_id, image_id, location_taken, user_address, details,
     entity['CroppedImageBlobURL'] = cropped_image_blob_url
     entity['IPFSCid'] = ipfs_cid
     entity['ImageClassification'] = image_classification
+    # Tables have no map type, so the size -> URL map is stored as JSON
+    entity['ThumbnailURLs'] = json.dumps(thumbnail_urls or {})
     pst = pytz.timezone('America/Los_Angeles')
     entity['DateAdded'] = datetime.datetime.now(pst).isoformat()
     table_client.create_entity(entity)
+    gallery_cache.invalidate(user_id)
+    try:
+        feed_table_client.create_entity(feed_entity(entity))
+    except Exception:
+        # Keep the gallery and the feed consistent; callers clean up the blobs
+        table_client.delete_entity(partition_key=user_id, row_key=image_id)
+        raise
     
 def url_to_blob(blob_url):
   parsed_url = urlparse(blob_url)
   path_parts = parsed_url.path.lstrip('/').split('/', 1)
   return path_parts[0], path_parts[1]
 
-def hash_password(password: str) -> str:
-    # Simple hashing for demonstration. Consider a stronger method for production.
-    return hashlib.sha256(password.encode()).hexdigest()
+async def is_authorized_user(user_id: str, authorization: Optional[str]) -> bool:
+    # A valid session token for this user skips the users table entirely
+    claims = session_claims(authorization)
+    if claims and claims.get("sub") == user_id:
+        return True
+    return await is_valid_username(user_id)
   
 async def is_valid_username(user_id: str) -> bool:
-    try:
-        # Query to check if the user exists
-        filter_query = f"PartitionKey eq '{user_id}' and RowKey eq 'userinfo'"
-        user_entities = list(users_table_client.query_entities(filter_query))
+    known = user_directory.contains(user_id)
+    if known is not None:
+        return known
 
-        return len(user_entities) > 0
+    try:
+        # Point read that fetches no user fields at all
+        exists = await run_storage(user_exists, users_table_client, user_id)
+
+        if exists:
+            user_directory.add(user_id)
+        else:
+            user_directory.add_missing(user_id)
+        return exists
     except Exception as e:
         # print(f"Error checking user validity: {e}")
         return False  # or raise an exception based on your error handling strategy
 
 @app.post("/mint-nft/")
 async def mint_nft(cid: str, user_address: str):
-    # Ensure Ethereum address is valid
-    if not web3.is_address(user_address):
-        raise HTTPException(status_code=400, detail="Invalid Ethereum address")
-
-    # Token URI (IPFS URL)
-    token_uri = f"ipfs://{cid}"
-
-    # Create a transaction
-    nonce = web3.eth.get_transaction_count(WALLET_ADDRESS)
-    # Prepare the transaction
-    txn = contract.functions.mintNFT(user_address, token_uri).build_transaction({
-        'from': WALLET_ADDRESS,  # The address the transaction is sent from
-        'chainId': 11155111,  # Replace with the correct chain ID
-        'gas': 2000000,
-        'gasPrice': web3.to_wei('50', 'gwei'),
-        'nonce': nonce,
-    })
-
-
-    # Sign the transaction
-    signed_txn = web3.eth.account.sign_transaction(txn, private_key=WALLET_PRIVATE_KEY)
-
-    # Send the transaction
-    txn_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
-
-    # # Wait for transaction receipt (optional)
-    # receipt = web3.eth.wait_for_transaction_receipt(txn_hash)
-    # print(txn_hash)
-
-    return {"transaction_hash": txn_hash, "status": "NFT Minted"}
+    job_id = await run_storage(mint_queue.enqueue, cid, checksum_eth_address(user_address))
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/mintStatus")
+async def mint_status(job_id: str):
+    job = await run_storage(mint_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Mint job not found")
+    return job_status(job)
 
 # if __name__ == "__main__":
 #     import uvicorn
@@ -0,0 +1,60 @@
+from typing import Dict, List, Optional, Tuple
+from azure.core.exceptions import ResourceNotFoundError
+from azure.data.tables import TableClient
+from pagination import read_page
+from feed_index import FEED_PARTITION
+
+# Image fields read by entity_to_image_info in server.py
+IMAGE_INFO_FIELDS: List[str] = [
+    'IPFSCid', 'DateAdded', 'LocationTaken', 'Details', 'Probability',
+    'ImageClassification', 'CroppedImageBlobURL', 'ImageBlobURL', 'ThumbnailURLs'
+]
+GALLERY_FIELDS: List[str] = ['PartitionKey', 'RowKey'] + IMAGE_INFO_FIELDS
+FEED_FIELDS: List[str] = ['UserId', 'ImageId'] + IMAGE_INFO_FIELDS
+
+USER_PROFILE_FIELDS: List[str] = ['Email', 'EthereumAddress']
+LOGIN_FIELDS: List[str] = ['Password'] + USER_PROFILE_FIELDS
+
+USER_INFO_ROW = 'userinfo'
+# The most rows Azure Tables returns per page
+MAX_PAGE_SIZE = 1000
+
+
+def query_user_images(table_client: TableClient, user_id: str) -> List[Dict]:
+    """
+    Returns every image row for a user with only the fields the gallery response needs.
+    """
+    filter_query = f"PartitionKey eq '{user_id}'"
+    return list(table_client.query_entities(filter_query, select=GALLERY_FIELDS, results_per_page=MAX_PAGE_SIZE))
+
+
+def query_feed_page(feed_table_client: TableClient, exclude_user_id: str, page_size: int,
+                    continuation_token: Optional[Dict] = None,
+                    select: Optional[List[str]] = None) -> Tuple[List[Dict], Optional[Dict]]:
+    """
+    Reads one page of the feed, newest first, skipping one user's images.
+
+    Returns:
+        The feed rows and the continuation token for the next page.
+    """
+    filter_query = f"PartitionKey eq '{FEED_PARTITION}' and UserId ne '{exclude_user_id}'"
+    select = select or FEED_FIELDS
+    return read_page(
+        lambda n: feed_table_client.query_entities(filter_query, select=select, results_per_page=n),
+        page_size,
+        continuation_token
+    )
+
+
+def get_user(users_table_client: TableClient, username: str, select: List[str]) -> Optional[Dict]:
+    """
+    Point-reads a user's userinfo row, returning only the selected fields, or None if there is no such user.
+    """
+    try:
+        return users_table_client.get_entity(partition_key=username, row_key=USER_INFO_ROW, select=select)
+    except ResourceNotFoundError:
+        return None
+
+
+def user_exists(users_table_client: TableClient, username: str) -> bool:
+    return get_user(users_table_client, username, select=['PartitionKey']) is not None
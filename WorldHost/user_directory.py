@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserDirectory:
+    """
+    In-memory set of known usernames, plus a short-lived cache of names that were looked up
+    and not found.
+
+    Usernames are never deleted, so a positive answer stays valid for the life of the process.
+    Negative answers expire after negative_ttl seconds so a user registered through another
+    worker is recognised soon after. At most max_missing of them are kept, oldest dropped first,
+    since anyone can look up a name that doesn't exist.
+    """
+
+    def __init__(self, negative_ttl=30, max_missing=10000):
+        self.negative_ttl = negative_ttl
+        self.max_missing = max_missing
+        self._known = set()
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm(self, usernames):
+        with self._lock:
+            self._known.update(usernames)
+
+    def add(self, username):
+        with self._lock:
+            self._known.add(username)
+            self._missing.pop(username, None)
+
+    def add_missing(self, username):
+        with self._lock:
+            now = time.monotonic()
+            self._missing[username] = now + self.negative_ttl
+            self._missing.move_to_end(username)
+            # Every entry has the same TTL, so the oldest are at the front and expire first
+            while self._missing:
+                expiry = next(iter(self._missing.values()))
+                if expiry >= now and len(self._missing) <= self.max_missing:
+                    break
+                self._missing.popitem(last=False)
+
+    def contains(self, username):
+        """
+        Returns True or False when the answer is known, or None when the table has to be asked.
+        """
+        with self._lock:
+            if username in self._known:
+                return True
+            expiry = self._missing.get(username)
+            if expiry is None:
+                return None
+            if expiry < time.monotonic():
+                del self._missing[username]
+                return None
+            return False
+
+    def __len__(self):
+        with self._lock:
+            return len(self._known)
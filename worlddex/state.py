@@ -1,8 +1,18 @@
 import httpx
+import importlib.util
 import reflex as rx
 from typing import List, Dict, Any
 from datetime import datetime
 
+# One client for every call to the WorldHost API, kept for the life of the app so requests reuse
+# pooled keep-alive connections instead of a new TLS handshake each time. HTTP/2 needs the h2
+# package (httpx[http2])
+http_client = httpx.Client(
+    http2=importlib.util.find_spec("h2") is not None,
+    timeout=httpx.Timeout(15.0, connect=5.0),
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+)
+
 
 def convert_date_format(date_str: str) -> str:
     # Parse the string into a datetime object
@@ -33,8 +43,7 @@ class ImageState(rx.State):
         params = {'user_id': self.username} 
         print("fetching...")
 
-        with httpx.Client() as client:  # using synchronous Client
-            response = client.get(url, params=params)
+        response = http_client.get(url, params=params)
 
         if response.status_code == 200:
             data = response.json()
@@ -87,8 +96,7 @@ class ImageState(rx.State):
         body = {'user_id': self.username, 'user_password': self.password, 'email' : self.email}
         url = 'https://worlddex.ngrok.app/signup'
 
-        with httpx.Client() as client:  # using synchronous Client
-            response = client.post(url, json=body)
+        response = http_client.post(url, json=body)
 
         if response.status_code == 200:
             self.fetch_data()